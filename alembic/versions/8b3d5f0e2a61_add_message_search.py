@@ -0,0 +1,49 @@
+"""Add full-text search of message content
+
+Revision ID: 8b3d5f0e2a61
+Revises: 6e4b2f8a1c07
+Create Date: 2021-03-09 19:41:52.730216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3d5f0e2a61'
+down_revision = '6e4b2f8a1c07'
+branch_labels = None
+depends_on = None
+
+
+def _fulltext_installed(bind):
+    return bool(bind.execute("SELECT FULLTEXTSERVICEPROPERTY('IsFullTextInstalled')").scalar())
+
+
+def upgrade():
+    bind = op.get_bind()
+    # The full-text index needs a unique, single column, non nullable key
+    op.execute('ALTER TABLE sl_messages ADD search_id BIGINT IDENTITY(1, 1) NOT NULL')
+    op.create_index(op.f('ix_sl_messages_search_id'), 'sl_messages', ['search_id'], unique=True)
+
+    # Without full-text search installed (e.g, the Linux docker image) the API falls back to LIKE
+    if _fulltext_installed(bind):
+        # Full-text DDL can't run inside a transaction
+        with op.get_context().autocommit_block():
+            op.execute('CREATE FULLTEXT CATALOG sl_messages_catalog')
+            op.execute("""
+                CREATE FULLTEXT INDEX ON sl_messages (content)
+                    KEY INDEX ix_sl_messages_search_id ON sl_messages_catalog
+                    WITH CHANGE_TRACKING AUTO""")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("""
+            IF EXISTS (SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('sl_messages'))
+                DROP FULLTEXT INDEX ON sl_messages""")
+        op.execute("""
+            IF EXISTS (SELECT 1 FROM sys.fulltext_catalogs WHERE name = 'sl_messages_catalog')
+                DROP FULLTEXT CATALOG sl_messages_catalog""")
+    op.drop_index(op.f('ix_sl_messages_search_id'), table_name='sl_messages')
+    op.drop_column('sl_messages', 'search_id')
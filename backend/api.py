@@ -1,15 +1,45 @@
 import logging
 import functools
+import hashlib
+import itertools
 
-from flask import Blueprint, request
-from werkzeug.exceptions import Unauthorized, NotFound
-from backend.helpers import route, try_parse_int
-from backend.services import slackemoji_service, slackfile_service, slackmessage_service, slackuser_service, app_service, slackchannel_service
+from flask import Blueprint, current_app, request, stream_with_context
+from werkzeug.exceptions import BadRequest, Unauthorized, NotFound
+from backend.helpers import json_dumps, json_response, route, try_parse_int
+from backend.services import slackemoji_service, slackfile_service, slackmessage_service, slackuser_service, app_service, slackchannel_service, \
+    data_version_service, cache, statchannelday_service, statemoji_service, statreactor_service, statuseractivity_service
 
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('api', __name__, url_prefix='/api/resource')
 
+# Slack resources, their services and the request args they can be filtered by
+_resources = dict(
+    users=(slackuser_service, ('tz_offset',)),
+    channels=(slackchannel_service, ()),
+    emojis=(slackemoji_service, ()),
+    files=(slackfile_service, ('channel_id', 'message_id')),
+    messages=(slackmessage_service, ('user_id', 'channel_id', 'thread_id'))
+)
+
+
+def _parse_batch(params, name):
+    """Return the list of items named by the given batch request's params, at
+    most BATCH_GET_MAX_ITEMS of them.
+    """
+    items = params[name]
+    max_items = current_app.config['BATCH_GET_MAX_ITEMS']
+    if not isinstance(items, list) or len(items) > max_items:
+        raise BadRequest(f'{name} must be a list of at most {max_items} items')
+    return items
+
+
+def _parse_filters(resource):
+    """Return the filters for given resource, parsed from the request args.
+    """
+    _, filter_names = _resources[resource]
+    return {name: request.args.get(name) for name in filter_names if name in request.args}
+
 
 def authorized(func):
     """Decorator that checks for authorization header before calling wrapped function.
@@ -23,23 +53,67 @@ def authorized(func):
     return decorator
 
 
+def cacheable(*datasets):
+    """Decorator that caches responses for the current version of the given data
+    sets (see DataVersion), so new data loaded by the ingester into any of them
+    moves on to new cache keys. Responses are tagged with an ETag, and matching If-None-Match
+    requests get a 304 without running the wrapped function. Clients may reuse 
+    responses for RESOURCE_CACHE_MAX_AGE seconds, including proxies as long 
+    as it's for the same API key.
+    """
+    def wrapper(func):
+        @functools.wraps(func)
+        def decorator(*args, **kwargs):
+            versions = ','.join(f'{name}/{data_version_service.get(name)}' for name in datasets)
+            args_key = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+            etag = hashlib.sha1(f'{versions}:{request.path}?{args_key}'.encode('utf-8')).hexdigest()
+            cache_key = f'response/{etag}'
+
+            if request.if_none_match.contains_weak(etag):
+                resp = current_app.response_class(status=304)
+            else:
+                data = cache.get(cache_key)
+                if data is not None:
+                    resp = current_app.response_class(data, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+                else:
+                    resp = func(*args, **kwargs)
+                    if not isinstance(resp, current_app.response_class):
+                        resp = json_response(*resp) if isinstance(resp, tuple) else json_response(resp)
+                    if resp.status_code == 200:
+                        cache.set(cache_key, resp.get_data(), timeout=current_app.config['RESOURCE_CACHE_TIMEOUT'])
+            resp.set_etag(etag)
+            resp.cache_control.public = True
+            resp.cache_control.max_age = current_app.config['RESOURCE_CACHE_MAX_AGE']
+            resp.vary.add('Authorization')
+            return resp
+        return decorator
+    return wrapper
+
+
 def pageable(func):
     """Decorator that help populates the wrapped function with pagination 
-    parameters, parsed from the request args.
+    parameters, parsed from the request args. Passing an `after` arg (even
+    empty) opts into cursor pagination instead of page numbers.
     """
     @functools.wraps(func)
     def decorator(*args, **kwargs):
         per_page = try_parse_int(request.args.get('per_page'), 50)
         page = try_parse_int(request.args.get('page'), 1)
+        total = request.args.get('total')
+        if total not in (None, 'exact', 'estimate', 'none'):
+            raise BadRequest(f'Invalid total: {total}, expected one of exact, estimate or none')
         kwargs['per_page'] = per_page if 10 <= per_page <= 50 else 50
         kwargs['page'] = page if page > 0 else 1
+        kwargs['after'] = request.args.get('after')
+        kwargs['total'] = total
         return func(*args, **kwargs)
     return decorator
 
 
 def sortable(func):
     """Decorator that helps populate the wrapped function with sort parameters,
-    parsed from the request args.
+    parsed from the request args. Which attributes can be sorted by is up to
+    each model (see __sortable__).
     """
     @functools.wraps(func)
     def decorator(*args, **kwargs):
@@ -47,76 +121,204 @@ def sortable(func):
             rv = request.args.get('sort').split(',')
             kwargs['sort'] = rv[0]
             kwargs['sort_dir'] = rv[1] if len(rv) == 2 else 'asc'
+            if len(rv) > 2 or kwargs['sort_dir'] not in ('asc', 'desc'):
+                raise BadRequest(f'Invalid sort: {request.args.get("sort")}, expected e.g sort=name or sort=name,desc')
         return func(*args, **kwargs)
     return decorator
 
 
+def projectable(func):
+    """Decorator that helps populate the wrapped function with the fields to
+    return, parsed from the comma separated `fields` request arg. Only those
+    fields (and the ids) are selected from the database.
+    """
+    @functools.wraps(func)
+    def decorator(*args, **kwargs):
+        if 'fields' in request.args:
+            kwargs['fields'] = tuple(filter(None, request.args.get('fields').split(','))) or None
+        return func(*args, **kwargs)
+    return decorator
+
+
+def includable(*relationships):
+    """Decorator that helps populate the wrapped function with the relationships
+    to include, parsed from the comma separated `include` request arg. All the
+    given relationships are included by default, `include=` includes none.
+    """
+    def wrapper(func):
+        @functools.wraps(func)
+        def decorator(*args, **kwargs):
+            if 'include' in request.args:
+                include = tuple(filter(None, request.args.get('include').split(',')))
+                invalid = set(include) - set(relationships)
+                if invalid:
+                    raise BadRequest(f'Invalid include: {",".join(sorted(invalid))}, expected any of {",".join(relationships)}')
+                kwargs['include'] = include
+            else:
+                kwargs['include'] = relationships
+            return func(*args, **kwargs)
+        return decorator
+    return wrapper
+
+
 @route(bp, '/slack/users', methods=['get'])
 @authorized
+@cacheable('users')
 @sortable 
 @pageable
-def list_users(page, per_page, sort=None, sort_dir=None):
-    filters = {}
-    if 'tz_offset' in request.args:
-        filters['tz_offset'] = request.args.get('tz_offset')
+@projectable
+def list_users(page, per_page, after=None, total=None, sort=None, sort_dir=None, fields=None):
+    filters = _parse_filters('users')
     return slackuser_service.find_all_with_paging(
         page=page, 
         per_page=per_page, 
+        after=after,
+        total=total,
         sort=sort, 
         sort_dir=sort_dir, 
+        fields=fields,
         **filters
     )
 
 
 @route(bp, '/slack/channels', methods=['get'])
 @authorized
+@cacheable('channels')
 @sortable
 @pageable
-def list_channels(page, per_page, sort=None, sort_dir=None):
+@projectable
+def list_channels(page, per_page, after=None, total=None, sort=None, sort_dir=None, fields=None):
     return slackchannel_service.find_all_with_paging(
         page=page, 
         per_page=per_page, 
+        after=after,
+        total=total,
         sort=sort, 
-        sort_dir=sort_dir
+        sort_dir=sort_dir,
+        fields=fields
     )
 
 
 @route(bp, '/slack/emojis', methods=['get'])
 @authorized
+@cacheable('messages')
 @sortable
 @pageable
-def list_emojis(page, per_page, sort=None, sort_dir=None):
+@projectable
+def list_emojis(page, per_page, after=None, total=None, sort=None, sort_dir=None, fields=None):
     return slackemoji_service.find_all_with_paging(
         page=page, 
         per_page=per_page, 
+        after=after,
+        total=total,
         sort=sort, 
-        sort_dir=sort_dir
+        sort_dir=sort_dir,
+        fields=fields
     )
 
 
 @route(bp, '/slack/files', methods=['get'])
 @authorized
+@cacheable('messages')
 @sortable
 @pageable
-def list_files(page, per_page, sort=None, sort_dir=None):
-    filters = {}
-    if 'channel_id' in request.args:
-        filters['channel_id'] = request.args.get('channel_id')
-    if 'message_id' in request.args:
-        filters['message_id'] = request.args.get('message_id')
+@projectable
+def list_files(page, per_page, after=None, total=None, sort=None, sort_dir=None, fields=None):
+    filters = _parse_filters('files')
     return slackfile_service.find_all_with_paging(
         page=page, 
         per_page=per_page,
+        after=after,
+        total=total,
         sort=sort,
         sort_dir=sort_dir, 
+        fields=fields,
         **filters
     )
 
 
+@route(bp, '/slack/messages:batchGet', methods=['post'], required_params=['messages'])
+@authorized
+@includable('files', 'reactions')
+def batch_get_messages(params, include):
+    """The given messages, e.g {"messages": [{"channel_id": "C..", "id": "16.."}]},
+    in the order given. Messages that aren't found are left out.
+    """
+    messages = _parse_batch(params, 'messages')
+    try:
+        keys = list(dict.fromkeys((str(m['channel_id']), str(m['id'])) for m in messages))
+    except (KeyError, TypeError):
+        raise BadRequest('Each message must have a channel_id and id')
+    return dict(items=slackmessage_service.find_all_by_keys(keys, include=include))
+
+
+@route(bp, '/slack/users:batchGet', methods=['post'], required_params=['ids'])
+@authorized
+def batch_get_users(params):
+    """The users with the given ids, e.g {"ids": ["U.."]}, in the order given.
+    Users that aren't found are left out.
+    """
+    ids = list(dict.fromkeys(str(id) for id in _parse_batch(params, 'ids')))
+    return dict(items=slackuser_service.find_all_by_ids(ids))
+
+
+@route(bp, '/slack/messages/search', methods=['get'])
+@authorized
+@cacheable('messages')
+@pageable
+@includable('files', 'reactions')
+def search_messages(page, per_page, include, after=None, total=None):
+    """Search messages content for all the words of the `q` arg, best matches
+    first. Takes the same filters as listing messages, but isn't sortable.
+    """
+    filters = _parse_filters('messages')
+    return slackmessage_service.search(
+        q=request.args.get('q'),
+        page=page,
+        per_page=per_page,
+        after=after,
+        include=include,
+        **filters
+    )
+
+
+@route(bp, '/slack/messages/<ch_id>/<thread_id>/thread', methods=['get'])
+@authorized
+@cacheable('messages')
+@includable('files', 'reactions')
+def get_thread(ch_id, thread_id, include):
+    """The whole thread started by the given message, oldest first."""
+    threads = slackmessage_service.find_threads([(ch_id, thread_id)], include=include)
+    if not threads:
+        raise NotFound
+    return dict(channel_id=ch_id, thread_id=thread_id, items=threads[(ch_id, thread_id)])
+
+
+@route(bp, '/slack/messages/threads:batchGet', methods=['post'], required_params=['threads'])
+@authorized
+@includable('files', 'reactions')
+def batch_get_threads(params, include):
+    """The whole of each of the given threads, e.g {"threads": [{"channel_id": 
+    "C..", "thread_id": "16.."}]}. Threads that aren't found are left out.
+    """
+    threads = _parse_batch(params, 'threads')
+    try:
+        keys = list(dict.fromkeys((str(t['channel_id']), str(t['thread_id'])) for t in threads))
+    except (KeyError, TypeError):
+        raise BadRequest('Each thread must have a channel_id and thread_id')
+    found = slackmessage_service.find_threads(keys, include=include)
+    return dict(items=[
+        dict(channel_id=channel_id, thread_id=thread_id, items=found[(channel_id, thread_id)])
+        for channel_id, thread_id in keys if (channel_id, thread_id) in found
+    ])
+
+
 @route(bp, '/slack/messages/<ch_id>/<msg_id>', methods=['get'])
 @authorized
-def get_message(ch_id, msg_id):
-    message = slackmessage_service.get_by_id(ch_id, msg_id)
+@cacheable('messages')
+@includable('files', 'reactions')
+def get_message(ch_id, msg_id, include):
+    message = slackmessage_service.get_by_id(ch_id, msg_id, include=include)
     if not message:
         raise NotFound
     return message
@@ -124,20 +326,115 @@ def get_message(ch_id, msg_id):
 
 @route(bp, '/slack/messages', methods=['get'])
 @authorized
+@cacheable('messages')
 @sortable
 @pageable
-def list_messages(page, per_page, sort=None, sort_dir=None):
-    filters = {}
-    if 'user_id' in request.args:
-        filters['user_id'] = request.args.get('user_id')
-    if 'channel_id' in request.args:
-        filters['channel_id'] = request.args.get('channel_id')
-    if 'thread_id' in request.args:
-        filters['thread_id'] = request.args.get('thread_id')
+@includable('files', 'reactions')
+@projectable
+def list_messages(page, per_page, include, after=None, total=None, sort=None, sort_dir=None, fields=None):
+    filters = _parse_filters('messages')
     return slackmessage_service.find_all_with_paging(
         page=page, 
         per_page=per_page,
+        after=after,
+        total=total,
         sort=sort,
         sort_dir=sort_dir,
+        fields=fields,
+        include=include,
         **filters
-    )
\ No newline at end of file
+    )
+
+
+@route(bp, '/slack/stats/messages', methods=['get'])
+@authorized
+@cacheable('messages')
+@sortable
+@pageable
+def stats_messages(page, per_page, after=None, total=None, sort=None, sort_dir=None):
+    """Number of messages per channel per day."""
+    filters = {name: request.args.get(name) for name in ('channel_id',) if name in request.args}
+    return statchannelday_service.find_all_with_paging(
+        page=page,
+        per_page=per_page,
+        after=after,
+        total=total,
+        sort=sort,
+        sort_dir=sort_dir,
+        **filters
+    )
+
+
+@route(bp, '/slack/stats/reactors', methods=['get'])
+@authorized
+@cacheable('messages')
+@sortable
+@pageable
+def stats_reactors(page, per_page, after=None, total=None, sort=None, sort_dir=None):
+    """Number of reactions per user, most first."""
+    return statreactor_service.find_all_with_paging(
+        page=page,
+        per_page=per_page,
+        after=after,
+        total=total,
+        sort=sort or 'reactions',
+        sort_dir=sort_dir or 'desc'
+    )
+
+
+@route(bp, '/slack/stats/emojis', methods=['get'])
+@authorized
+@cacheable('messages')
+@sortable
+@pageable
+def stats_emojis(page, per_page, after=None, total=None, sort=None, sort_dir=None):
+    """Number of reactions per emoji, most used first."""
+    return statemoji_service.find_all_with_paging(
+        page=page,
+        per_page=per_page,
+        after=after,
+        total=total,
+        sort=sort or 'reactions',
+        sort_dir=sort_dir or 'desc'
+    )
+
+
+@route(bp, '/slack/stats/timezones', methods=['get'])
+@authorized
+@cacheable('messages', 'users')
+def stats_timezones():
+    """Number of active users (and their messages) per timezone offset. The 
+    timezones come from the users, so loading either data set invalidates it.
+    """
+    return dict(items=statuseractivity_service.by_tz_offset())
+
+
+@route(bp, '/slack/<resource>/export', methods=['get'])
+@authorized
+@sortable
+@includable('files', 'reactions')
+def export(resource, include, sort=None, sort_dir=None):
+    """Stream all the items of the given resource as newline delimited JSON, 
+    takes the same filters as listing the resource.
+    """
+    if resource not in _resources:
+        raise NotFound
+    service, _ = _resources[resource]
+    kwargs = _parse_filters(resource)
+    if resource == 'messages':
+        kwargs['include'] = include
+
+    batches = service.iter_all(sort=sort, sort_dir=sort_dir, **kwargs)
+    # Fetched before the response starts, so an invalid sort (or a database 
+    # error) fails the request with it's status, rather than cutting the 200 
+    # response short once it's already streaming
+    first = next(batches, None)
+
+    def generate():
+        if first is None:
+            return
+        for models in itertools.chain([first], batches):
+            yield b''.join(json_dumps(model) + b'\n' for model in models)
+    return current_app.response_class(
+        stream_with_context(generate()), 
+        mimetype='application/x-ndjson')
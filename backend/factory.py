@@ -1,7 +1,7 @@
 import logging
 
 from flask import Flask, jsonify
-from backend import settings, api, frontend, auth, services, datastores, helpers
+from backend import settings, api, frontend, auth, services, datastores, helpers, metrics
 
 
 def create_config_only_app():
@@ -17,7 +17,7 @@ def create_config_only_app():
 
     logging.getLogger('azure').setLevel(app.config['AZURE_LOG_LVL'])
     logging.getLogger('urllib3').setLevel(app.config['URLLIB_LOG_LVL'])
-    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+    logging.getLogger('sqlalchemy.engine').setLevel(app.config['SQL_LOG_LVL'])
     
     return app
 
@@ -40,6 +40,8 @@ def create_app():
     app.json_encoder = helpers.JSONEncoder
 
     datastores.db.init_app(app)
+    metrics.init_app(app)
+    services.data_version_service.init_app(app)
     services.user_service.init_app(app)
     services.app_service.init_app(app)
     services.slackuser_service.init_app(app)
@@ -48,6 +50,10 @@ def create_app():
     services.slackemoji_service.init_app(app)
     services.slackfile_service.init_app(app)
     services.slackreaction_service.init_app(app)
+    services.statchannelday_service.init_app(app)
+    services.statreactor_service.init_app(app)
+    services.statemoji_service.init_app(app)
+    services.statuseractivity_service.init_app(app)
     services.storage_service.init_app(app)
     
     services.cache.init_app(app)
@@ -59,6 +65,7 @@ def create_app():
     
     app.errorhandler(500)(lambda e: (jsonify(dict(error="Doh, please try again later!")), 500))
     app.errorhandler(404)(lambda e: (jsonify(dict(error="Sorry, we can't seem to find the requested page.")), 404))
+    app.errorhandler(400)(lambda e: (jsonify(dict(error=e.description)), 400))
     app.errorhandler(401)(lambda e: (jsonify(dict(error="Whoa there buddy, doesn't look like you're authorized.")), 401))
     
     return app
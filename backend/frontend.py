@@ -58,6 +58,7 @@ def delete_app(id, user):
 @auth.authenticated
 def delete_user(user):
     user_service.soft_delete(user['id'])
+    app_service.uncache_user_tokens(user['id'])
     return jsonify(user), 200
 
 
@@ -1,7 +1,24 @@
+import base64
+import binascii
 import inspect
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import date, datetime
 
 from functools import wraps
-from flask import request, jsonify, json
+from flask import current_app, request, jsonify, json
+from werkzeug.exceptions import BadRequest
+from werkzeug.wrappers import Response
+
+from backend import metrics
+
+try:
+    # Optional, faster json backend
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def parse_params(required_params):
@@ -13,8 +30,8 @@ def parse_params(required_params):
     params = {}
     if (request.content_type or '').startswith('multipart'):
         params = request.form
-    elif request.is_json():
-        params = request.get_json()
+    elif request.is_json:
+        params = request.get_json(silent=True) or {}
     missing_params = []
     for name in required_params:
         if params.get(name) is None:
@@ -29,22 +46,50 @@ def route(bp, *args, required_params=[], **kwargs):
         @wraps(f)
         def wrapper(*args, **kwargs):
             # route defs with can ask for request params to be parse 
-            # by specifying a params function argument
-            if 'params' in inspect.getfullargspec(f).args:
+            # by specifying a params function argument (signature follows 
+            # functools.wraps, so it's found through other decorators)
+            if 'params' in inspect.signature(f).parameters:
                 params, missing_params = parse_params(required_params)
                 if missing_params:
                    return jsonify(dict(error=f'Missing required params: {missing_params}')), 400
                 kwargs['params'] = params
             status = 200
             resp = f(*args, **kwargs)
+            if isinstance(resp, Response):
+                return resp
             if isinstance(resp, tuple):
-                resp = resp[0]
-                status = resp[1]
-            return jsonify(resp), status
+                resp, status = resp
+            return json_response(resp, status)
         return f
     return decorator
 
 
+def json_dumps(obj):
+    """Encode the given object to compact JSON bytes, with orjson when it's 
+    installed. Models are encoded through their compiled serializers.
+    """
+    if orjson is None:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if current_app.config['JSON_SORT_KEYS']:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_json_encoder.default, option=option)
+
+
+def json_response(obj, status=200):
+    """Like `jsonify`, but encodes with orjson when it's installed (see json_dumps).
+    """
+    with metrics.serializing():
+        if orjson is None or current_app.debug or current_app.config['JSONIFY_PRETTYPRINT_REGULAR']:
+            resp = jsonify(obj)
+        else:
+            resp = current_app.response_class(
+                json_dumps(obj) + b'\n',
+                mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    resp.status_code = status
+    return resp
+
+
 def try_parse_int(s, val=None):
     try:
         return int(s)
@@ -52,6 +97,76 @@ def try_parse_int(s, val=None):
         return val
 
 
+def encode_cursor(values):
+    """Encode the given list of keyset values into an opaque, url safe 
+    cursor token.
+    """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token created by `encode_cursor` back into it's list
+    of keyset values. An empty token decodes to an empty list (e.g, start 
+    from the beginning). Raises BadRequest unless each value is a str, number
+    or None, the caller checks there's a value for each of it's keys.
+    """
+    if not token:
+        return []
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise BadRequest(f'Invalid cursor: {token}')
+    if not isinstance(values, list) or not all(
+            v is None or (isinstance(v, (str, int, float)) and not isinstance(v, bool)) for v in values):
+        raise BadRequest(f'Invalid cursor: {token}')
+    return values
+
+
+class LRUCache:
+    """Small thread safe, in process LRU cache, holding at most `maxsize` entries
+    which also expire `ttl` seconds after being set.
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        """Delete every entry whose value matches the given predicate."""
+        with self._lock:
+            for key in [k for k, (v, _) in self._entries.items() if predicate(v)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class JSONSerializer:
     """Marker class"""
 
@@ -60,4 +175,12 @@ class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, JSONSerializer):
             return obj.to_json()
+        # Flask formats dates like datetimes (as HTTP dates), plain ISO dates are clearer for days
+        if isinstance(obj, date) and not isinstance(obj, datetime):
+            return obj.isoformat()
         return super(JSONEncoder, self).default(obj)
+
+
+# Fallback for types orjson doesn't handle, e.g models and datetimes (which we 
+# pass through so they're formatted the same as with Flask's json)
+_json_encoder = JSONEncoder()
@@ -0,0 +1,251 @@
+import bisect
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from flask import Blueprint, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+from werkzeug.exceptions import NotFound
+
+from backend.datastores import db
+
+logger = logging.getLogger(__name__)
+bp = Blueprint('metrics', __name__)
+
+_seconds_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+_statement_buckets = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """Thread safe, in process histogram (Prometheus style, with cumulative
+    buckets) keeping a series per set of label values.
+    """
+    def __init__(self, name, help, labels, buckets=_seconds_buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values: [count per bucket..., count over the last bucket, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        """Return the histogram in the Prometheus text format, as a list of lines."""
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, counts in series:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            total = 0
+            for le, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {total}')
+            lines.append(f'{self.name}_sum{{{labels}}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {total}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_seconds = Histogram(
+    'ubtsapi_request_seconds', 'Time taken to handle requests.',
+    ('endpoint', 'method', 'status'))
+request_sql_statements = Histogram(
+    'ubtsapi_request_sql_statements', 'Number of SQL statements run per request.',
+    ('endpoint',), buckets=_statement_buckets)
+request_sql_seconds = Histogram(
+    'ubtsapi_request_sql_seconds', 'Time spent running SQL statements per request.',
+    ('endpoint',))
+request_serialize_seconds = Histogram(
+    'ubtsapi_request_serialize_seconds', 'Time spent serializing responses per request.',
+    ('endpoint',))
+
+histograms = [request_seconds, request_sql_statements, request_sql_seconds, request_serialize_seconds]
+
+# Number of new DBAPI connections made by this process, a jump means the pool 
+# is reconnecting (e.g, after connections were dropped)
+_connections = dict(created=0)
+_connections_lock = threading.Lock()
+
+
+def _pool_connect(dbapi_conn, connection_record):
+    with _connections_lock:
+        _connections['created'] += 1
+
+
+def pool_status():
+    """Return the app's engine pool status in the Prometheus text format, as a
+    list of lines. Only queue pools (e.g, not SQLite's) have a status to report.
+    """
+    lines = [
+        '# HELP ubtsapi_db_connections_created_total New database connections made.',
+        '# TYPE ubtsapi_db_connections_created_total counter',
+        f'ubtsapi_db_connections_created_total {_connections["created"]}'
+    ]
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        lines.extend([
+            '# HELP ubtsapi_db_pool_size Connections the engine pool keeps open.',
+            '# TYPE ubtsapi_db_pool_size gauge',
+            f'ubtsapi_db_pool_size {pool.size()}',
+            '# HELP ubtsapi_db_pool_connections Connections in the engine pool, by state.',
+            '# TYPE ubtsapi_db_pool_connections gauge',
+            f'ubtsapi_db_pool_connections{{state="checked_in"}} {pool.checkedin()}',
+            f'ubtsapi_db_pool_connections{{state="checked_out"}} {pool.checkedout()}',
+            f'ubtsapi_db_pool_connections{{state="overflow"}} {max(pool.overflow(), 0)}'
+        ])
+    return lines
+
+
+class RequestStats:
+    """Performance stats for a single request, see `current_stats`."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0
+        self.serialize_seconds = 0
+        # Number of times each statement has run, see REPEATED_STATEMENT_LIMIT
+        self.statement_counts = {}
+
+
+class RepeatedStatementError(Exception):
+    """Raised (when testing) once a request runs the same statement more than
+    REPEATED_STATEMENT_LIMIT times, e.g a relationship loaded one model at a time.
+    """
+
+
+def current_stats():
+    """Return the current request's stats, or None outside of a request (e.g,
+    in the manage commands).
+    """
+    if not has_request_context():
+        return None
+    return g.get('_request_stats')
+
+
+@contextmanager
+def serializing():
+    """Context manager timing the serialization of a response, e.g
+
+        with metrics.serializing():
+            body = json_dumps(obj)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - started
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_statements_started', []).append(time.perf_counter())
+
+
+def _params_shape(parameters, executemany):
+    """Describe the given statement parameters without their values, e.g
+    `3 params` or `500 rows x 3 params`.
+    """
+    if executemany:
+        rows = list(parameters)
+        return f'{len(rows)} rows x {len(rows[0]) if rows else 0} params'
+    return f'{len(parameters or ())} params'
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['_statements_started'].pop()
+    endpoint = (request.endpoint or 'none') if has_request_context() else 'none'
+    slow_query_ms = current_app.config['SLOW_QUERY_MS'] if current_app else 0
+    if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+        logger.warning(f'Slow statement ({elapsed * 1000:.0f}ms, {_params_shape(parameters, executemany)}) '
+                       f'in {endpoint}: {statement}')
+
+    stats = current_stats()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.sql_seconds += elapsed
+
+    limit = current_app.config['REPEATED_STATEMENT_LIMIT']
+    count = stats.statement_counts[statement] = stats.statement_counts.get(statement, 0) + 1
+    # Only once per statement per request
+    if limit and count == limit + 1:
+        message = f'Statement run more than {limit} times in {endpoint} (N+1?): {statement}'
+        if current_app.testing:
+            raise RepeatedStatementError(message)
+        logger.warning(message)
+
+
+def _handle_error(context):
+    # after_cursor_execute isn't called for failed statements
+    started = context.connection.info.get('_statements_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _before_request():
+    g._request_stats = RequestStats()
+
+
+def _after_request(resp):
+    stats = g.pop('_request_stats', None)
+    if stats is None:
+        return resp
+    elapsed = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'none'
+    request_seconds.observe(elapsed, endpoint, request.method, str(resp.status_code))
+    request_sql_statements.observe(stats.statements, endpoint)
+    request_sql_seconds.observe(stats.sql_seconds, endpoint)
+    request_serialize_seconds.observe(stats.serialize_seconds, endpoint)
+    if current_app.config['METRICS_SERVER_TIMING']:
+        resp.headers.add('Server-Timing', ', '.join([
+            f'db;desc="{stats.statements} statements";dur={stats.sql_seconds * 1000:.1f}',
+            f'serialize;dur={stats.serialize_seconds * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}'
+        ]))
+    return resp
+
+
+@bp.route('/metrics')
+def expose():
+    """Metrics in the Prometheus text format. Note metrics are kept per process,
+    with several workers each scrape only sees the worker that served it.
+    Not found unless METRICS_ENABLED, they're not authenticated.
+    """
+    if not current_app.config['METRICS_ENABLED']:
+        raise NotFound()
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.expose())
+    lines.extend(pool_status())
+    return current_app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request, and the SQL statements it runs, with the given app."""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        event.listen(Pool, 'connect', _pool_connect)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(bp)
@@ -1,6 +1,12 @@
+import operator
+import re
 
-from sqlalchemy import func
+from sqlalchemy import DDL, and_, event, false, func, literal_column, or_, table, column, text
+from sqlalchemy.orm import RelationshipProperty, load_only
+from sqlalchemy.orm.base import instance_state
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql.schema import ForeignKeyConstraint
+from werkzeug.exceptions import BadRequest, NotFound
 from backend.datastores import db
 from backend.helpers import JSONSerializer
 
@@ -8,6 +14,15 @@ from backend.helpers import JSONSerializer
 class BaseModel(JSONSerializer):
     __json_exclude__ = []
     __default_sort__ = None
+    # Attributes that can be sorted by, each should lead an index (followed by 
+    # the primary key) so sorting never has to sort the whole table
+    __sortable__ = ()
+    # Attributes that can be sorted by when filtering by the given attribute,
+    # e.g {'user_id': ('id',)}, as the filter followed by each of these should
+    # lead an index too. Other filters can be sorted by any of __sortable__
+    __filtered_sortable__ = {}
+    # Name of the data set (see DataVersion) the ingester loads this model with
+    __dataset__ = None
 
     @classmethod
     def count(cls, id=None):
@@ -15,6 +30,27 @@ class BaseModel(JSONSerializer):
             return db.session.query(func.count(id)).scalar()
         return db.session.query(func.count(cls.id)).scalar()
 
+    @classmethod
+    def count_by(cls, **kwargs):
+        """Return the number of models specified by the given parameters.
+        """
+        if not kwargs:
+            return cls.count()
+        return cls.query.filter_by(**kwargs).order_by(None).count()
+
+    @classmethod
+    def estimate_count(cls):
+        """Return the approximate number of models, read from SQL Server's
+        partition stats rather than scanning the table. Other databases 
+        fallback to an exact count.
+        """
+        if db.engine.dialect.name != 'mssql':
+            return cls.count()
+        return db.session.execute(text("""
+            SELECT SUM(row_count) FROM sys.dm_db_partition_stats
+             WHERE object_id = OBJECT_ID(:table_name) AND index_id IN (0, 1)
+        """), dict(table_name=cls.__tablename__)).scalar() or 0
+
     @classmethod
     def save(cls, model):
         """Persist the given model to underlying datastore.
@@ -56,6 +92,15 @@ class BaseModel(JSONSerializer):
         """
         return cls.query.get(id)
 
+    @classmethod
+    def find_all_by_ids(cls, ids):
+        """Return the models with the given ids, in one query. Models that
+        aren't found are left out, and the order isn't guaranteed.
+        """
+        if not ids:
+            return []
+        return cls.query.filter(cls.id.in_(set(ids))).all()
+
     @classmethod
     def find_one(cls, **kwargs):
         """Return the model specified by the given parameters from the 
@@ -65,15 +110,28 @@ class BaseModel(JSONSerializer):
         return model
 
     @classmethod
-    def _prepare_query(cls, sort=None, sort_dir=None, **kwargs):
-        query = cls.query
+    def _project(cls, query, fields, keys=()):
+        """Only load the given column attributes (along with the given keys and
+        the primary key) for the models selected by the given query, e.g so 
+        large columns like content aren't selected when they're not needed.
+        """
+        if not fields:
+            return query
+        columns = [prop.key for prop in cls.__mapper__.column_attrs if prop.key not in cls.__json_exclude__]
+        invalid = set(fields) - set(columns)
+        if invalid:
+            raise BadRequest(f'Invalid fields: {",".join(sorted(invalid))}, expected any of {",".join(columns)}')
+        primary_keys = [cls.__mapper__.get_property_by_column(column).key for column in cls.__mapper__.primary_key]
+        return query.options(load_only(*dict.fromkeys([*fields, *keys, *primary_keys])))
+
+    @classmethod
+    def _prepare_query(cls, sort=None, sort_dir=None, fields=None, **kwargs):
+        query = cls._project(cls.query, fields)
         if kwargs:
             query = query.filter_by(**kwargs)
-        if sort:
-            query = query.order_by(getattr(getattr(cls, sort), sort_dir)())
-        elif cls.__default_sort__:
-            query = query.order_by(cls.__default_sort__)
-        return query
+        # Same order as keyset pagination, so ties are always in the same order
+        sort_dir = sort_dir or 'asc'
+        return query.order_by(*[getattr(getattr(cls, k), sort_dir)() for k in cls._keyset_keys(sort, kwargs)])
 
     @classmethod
     def find_all(cls, **kwargs):
@@ -87,15 +145,94 @@ class BaseModel(JSONSerializer):
     def find_all_with_paging(cls, page, per_page, **kwargs):
         """Find and return list of models specified by the given parameters
         from the underlying datastore. Results are paged back and controlled
-        via the page and per_page parameters.
+        via the page and per_page parameters. Note: total is not counted
+        here, see `count_by`.
         """
         query = cls._prepare_query(**kwargs)
-        rv = query.paginate(page=page, per_page=per_page)
+        items = query.limit(per_page).offset((page - 1) * per_page).all()
+        if not items and page != 1:
+            raise NotFound()
         return dict(
             page=page,
             per_page=per_page,
-            items=rv.items,
-            total=rv.total
+            items=items
+        )
+
+    @classmethod
+    def _keyset_keys(cls, sort=None, filters=()):
+        """Return the attribute names that uniquely order this model, the sort
+        attribute followed by any primary key attributes not already sorted on.
+        Raises BadRequest if the model can't be sorted by the given attribute,
+        or not while filtering by the given (names of) filters.
+        """
+        if sort and sort not in cls.__sortable__:
+            raise BadRequest(f'Invalid sort: {sort}, expected one of {",".join(cls.__sortable__)}')
+        for name in filters:
+            sortable = cls.__filtered_sortable__.get(name)
+            if sort and sortable is not None and sort not in sortable:
+                raise BadRequest(f'Invalid sort: {sort} when filtering by {name}, expected one of {",".join(sortable)}')
+        keys = [sort or cls.__default_sort__] if (sort or cls.__default_sort__) else []
+        for column in cls.__mapper__.primary_key:
+            key = cls.__mapper__.get_property_by_column(column).key
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    @classmethod
+    def _keyset_after(cls, keys, values, sort_dir):
+        """Build the criteria selecting rows ordered after the row identified by
+        the given keyset values, e.g for keys (a, b): a > ? OR (a = ? AND b > ?).
+        Keys are attribute names, or column expressions.
+        
+        Note: we can't use row value comparisons (not supported on SQL Server), 
+        and NULLs are treated as the lowest value (SQL Server and SQLite ordering).
+        """
+        def eq(attr, value):
+            return attr.is_(None) if value is None else attr == value
+
+        def after(attr, value):
+            if sort_dir == 'desc':
+                return false() if value is None else or_(attr < value, attr.is_(None))
+            return attr.isnot(None) if value is None else attr > value
+
+        attrs = [getattr(cls, k) if isinstance(k, str) else k for k in keys]
+        clauses = []
+        for i, attr in enumerate(attrs):
+            preceding = [eq(a, v) for a, v in zip(attrs[:i], values[:i])]
+            clauses.append(and_(*preceding, after(attr, values[i])))
+        return or_(*clauses)
+
+    @classmethod
+    def find_all_with_cursor(cls, per_page, after=None, sort=None, sort_dir=None, fields=None, **kwargs):
+        """Find and return list of models specified by the given parameters
+        from the underlying datastore. Results are paged back with keyset 
+        pagination, each page starts after the row identified by the `after`
+        keyset values (see `next` from the previous page), so the cost of a 
+        page stays the same no matter how deep into the results we are.
+        """
+        keys = cls._keyset_keys(sort, kwargs)
+        sort_dir = sort_dir or 'asc'
+        if after and len(after) != len(keys):
+            raise BadRequest('Cursor does not match the requested sort')
+
+        # The keys are always loaded, the next cursor is made from them
+        query = cls._project(cls.query, fields, keys)
+        if kwargs:
+            query = query.filter_by(**kwargs)
+        if after:
+            query = query.filter(cls._keyset_after(keys, after, sort_dir))
+        query = query.order_by(*[getattr(getattr(cls, k), sort_dir)() for k in keys])
+
+        # Fetch one extra row to tell if there's a next page
+        items = query.limit(per_page + 1).all()
+        next = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next = [getattr(items[-1], k) for k in keys]
+        return dict(
+            per_page=per_page,
+            items=items,
+            next=next
         )
 
     @classmethod
@@ -116,64 +253,362 @@ class BaseModel(JSONSerializer):
     def to_json(self):
         """Returns a json serializable representation (e.g, dict) of this model.
         """ 
-        rv = {}
-        # https://docs.sqlalchemy.org/en/13/orm/mapping_api.html#sqlalchemy.orm.Mapper.iterate_properties
-        for prop in self.__mapper__.iterate_properties:
-            if prop.key not in self.__json_exclude__:
-                rv[prop.key] = getattr(self, prop.key)
+        return self.__serializer__(self)
+
+
+def compile_serializer(cls):
+    """Compile a function that serializes models of the given class into dicts.
+    The properties to serialize are worked out once here, rather than walking
+    the mapper's properties for every model we serialize. Relationships are
+    only serialized when they've already been loaded (e.g, load_related), and
+    columns when they've been selected (see _project), so serializing never 
+    triggers more queries.
+    """
+    exclude = set(cls.__json_exclude__)
+    columns = []
+    relationships = []
+    # https://docs.sqlalchemy.org/en/13/orm/mapping_api.html#sqlalchemy.orm.Mapper.iterate_properties
+    for prop in cls.__mapper__.iterate_properties:
+        if prop.key in exclude:
+            continue
+        if isinstance(prop, RelationshipProperty):
+            relationships.append((prop.key, prop.mapper.class_))
+        else:
+            columns.append(prop.key)
+    columns = tuple(columns)
+    relationships = tuple(relationships)
+    # attrgetter returns a bare value rather than a tuple for a single attribute
+    get_columns = operator.attrgetter(*columns) if len(columns) > 1 \
+        else (lambda model, getter=operator.attrgetter(*columns): (getter(model),))
+
+    column_keys = frozenset(columns)
+
+    def serialize(model):
+        loaded = model.__dict__
+        if loaded.keys() >= column_keys:
+            rv = dict(zip(columns, get_columns(model)))
+        else:
+            # Leave out columns that weren't selected (see _project), but do 
+            # refresh those that have just expired (e.g, after a commit)
+            state = instance_state(model)
+            skip = state.unloaded - state.expired_attributes
+            rv = {key: getattr(model, key) for key in columns if key not in skip}
+        for key, related_cls in relationships:
+            if key in loaded:
+                related_serializer = related_cls.__serializer__
+                rv[key] = [related_serializer(related) for related in loaded[key]]
         return rv
+    return serialize
+
+
+@event.listens_for(BaseModel, 'mapper_configured', propagate=True)
+def _compile_model_serializer(mapper, cls):
+    cls.__serializer__ = staticmethod(compile_serializer(cls))
+
+
+class DataVersion(BaseModel, db.Model):
+    """Version of each data set, bumped by the ingester after every load so 
+    anything cached for a data set can tell it's stale.
+    """
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def get_version(cls, name):
+        model = cls.query.get(name)
+        return model.version if model else 0
+
+
+class IngestFile(BaseModel, db.Model):
+    """Ledger of the files loaded by the ingester, keyed by content hash, with
+    how many records of each have been committed so a failed load can resume
+    and a redelivered file can be skipped.
+    """
+    __tablename__ = 'ingest_files'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    dataset = db.Column(db.String(20), nullable=False)
+    name = db.Column(db.String(255), nullable=False, index=True)
+    records = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    completed_at = db.Column(db.DateTime)
 
 
 class SlackUser(BaseModel, db.Model):
     __tablename__ = 'sl_users'
     __default_sort__ = 'name'
+    __sortable__ = ('id', 'name', 'full_name', 'tz_offset')
+    __dataset__ = 'users'
     __json_exclude__ = ['archived_at']
 
     id = db.Column(db.String(11), primary_key=True)
-    name = db.Column(db.Unicode(80), nullable=False, index=True)
+    name = db.Column(db.Unicode(80), nullable=False)
     full_name = db.Column(db.Unicode(80))
     description = db.Column(db.Unicode(250))
     avatar_id = db.Column(db.String(16))
     tz_offset = db.Column(db.String(9))
     archived_at = db.Column(db.DateTime, nullable=False, index=True)
 
+    # Indexes for each sort followed by the rest of the keyset (see _keyset_keys), 
+    # and each filter followed by the default sort
+    __table_args__ = (
+        db.Index('ix_sl_users_name_id', 'name', 'id'),
+        db.Index('ix_sl_users_full_name_id', 'full_name', 'id'),
+        db.Index('ix_sl_users_tz_offset_name_id', 'tz_offset', 'name', 'id'),
+        db.Index('ix_sl_users_tz_offset_full_name_id', 'tz_offset', 'full_name', 'id'),
+        db.Index('ix_sl_users_tz_offset_id', 'tz_offset', 'id'),
+    )
+
 
 class SlackChannel(BaseModel, db.Model):
     __tablename__ = 'sl_channels'
     __default_sort__ = 'name'
+    __sortable__ = ('id', 'name')
+    __dataset__ = 'channels'
     __json_exclude__ = ['archived_at']
 
     id = db.Column(db.String(11), primary_key=True)
-    name = db.Column(db.String(80), nullable=False, index=True)
+    name = db.Column(db.String(80), nullable=False)
     description = db.Column(db.Unicode(250))
     archived_at = db.Column(db.DateTime, nullable=False, index=True)
 
+    __table_args__ = (
+        db.Index('ix_sl_channels_name_id', 'name', 'id'),
+    )
+
 
 class SlackMessage(BaseModel, db.Model):
     __tablename__ = 'sl_messages'
     __default_sort__ = 'id'
-    __json_exclude__ = ['deleted']
-
+    __sortable__ = ('id', 'channel_id', 'user_id')
+    # Sorting e.g a user's messages by channel would need an index per pair
+    __filtered_sortable__ = {
+        'user_id': ('id', 'user_id'),
+        'channel_id': ('id', 'channel_id'),
+        'thread_id': ('id',)
+    }
+    __dataset__ = 'messages'
+    __json_exclude__ = ['deleted', 'search_id']
+    # How content is searched, worked out on first search (see search_backend)
+    __search_backend__ = None
 
     id = db.Column(db.String(17), primary_key=True)
     channel_id = db.Column(db.ForeignKey('sl_channels.id'), primary_key=True)
-    thread_id = db.Column(db.String(17), index=True)
+    thread_id = db.Column(db.String(17))
     content = db.Column(db.UnicodeText(None))
-    user_id = db.Column(db.ForeignKey('sl_users.id'), index=True)
+    user_id = db.Column(db.ForeignKey('sl_users.id'))
     deleted = db.Column(db.Boolean, index=True)
+    # Single column key SQL Server's full-text index needs (an IDENTITY), never loaded
+    search_id = db.deferred(db.Column(db.BigInteger, nullable=False, index=True, unique=True))
 
-    files = db.relationship('SlackFile', foreign_keys='SlackFile.message_id,SlackFile.channel_id', lazy='subquery')
-    reactions = db.relationship('SlackReaction', foreign_keys='SlackReaction.message_id,SlackReaction.channel_id', lazy='subquery')
+    # Not eagerly loaded, see load_related
+    files = db.relationship('SlackFile', foreign_keys='SlackFile.message_id,SlackFile.channel_id')
+    reactions = db.relationship('SlackReaction', foreign_keys='SlackReaction.message_id,SlackReaction.channel_id')
+
+    __table_args__ = (
+        # Whole threads are read with a seek, then a key lookup per message for
+        # the rest of it (content would be too big to INCLUDE), see find_threads
+        db.Index('ix_sl_messages_channel_thread', 'channel_id', 'thread_id', 'id'),
+        # Filtering (or sorting) by each of these, followed by the default sort (id) 
+        # and the rest of the keyset
+        db.Index('ix_sl_messages_channel_id_id', 'channel_id', 'id'),
+        db.Index('ix_sl_messages_thread_id_id', 'thread_id', 'id', 'channel_id'),
+        db.Index('ix_sl_messages_user_id_id', 'user_id', 'id', 'channel_id'),
+    )
 
     @classmethod
     def get(cls, channel_id, message_id):
         """Custom get for SlackMessage as it has a composite key"""
         return cls.query.get((message_id, channel_id))
 
+    @classmethod
+    def load_related(cls, messages, include=('files', 'reactions')):
+        """Load the included relationships (e.g, files) for all the given messages,
+        with one query per relationship keyed on the messages (id, channel_id).
+
+        Note: SQL Server doesn't support tuple IN, so we select by message ids 
+        and channel ids, then match up the exact pairs here.
+        """
+        if not messages:
+            return messages
+        message_ids = {m.id for m in messages}
+        channel_ids = {m.channel_id for m in messages}
+        for key in include:
+            related_cls = cls.__mapper__.relationships[key].mapper.class_
+            related = {(m.id, m.channel_id): [] for m in messages}
+            query = related_cls.query.filter(
+                related_cls.message_id.in_(message_ids),
+                related_cls.channel_id.in_(channel_ids))
+            for model in query:
+                related.get((model.message_id, model.channel_id), []).append(model)
+            for message in messages:
+                set_committed_value(message, key, related[(message.id, message.channel_id)])
+        return messages
+
+    @classmethod
+    def find_all_by_keys(cls, keys):
+        """Return a dict of the messages with the given (channel_id, id) keys, 
+        found in one query. Like load_related, we select by channel ids and 
+        message ids, then match up the exact pairs here.
+        """
+        if not keys:
+            return {}
+        query = cls.query.filter(
+            cls.channel_id.in_({channel_id for channel_id, _ in keys}),
+            cls.id.in_({id for _, id in keys}))
+        wanted = set(keys)
+        rv = {}
+        for message in query:
+            key = (message.channel_id, message.id)
+            if key in wanted:
+                rv[key] = message
+        return rv
+
+    @classmethod
+    def find_threads(cls, threads):
+        """Find the messages of each of the given (channel_id, thread_id) threads,
+        the parent message and it's replies, in one query. Returns a dict of
+        the messages (oldest first) by thread, for threads that were found.
+
+        Note: as with load_related, we select by channel ids and thread ids, then
+        match up the exact pairs here.
+        """
+        if not threads:
+            return {}
+        channel_ids = {channel_id for channel_id, _ in threads}
+        thread_ids = {thread_id for _, thread_id in threads}
+        # Each side of the OR seeks an index (rather than scanning the channels)
+        query = cls.query.filter(or_(
+            and_(cls.channel_id.in_(channel_ids), cls.thread_id.in_(thread_ids)),
+            and_(cls.channel_id.in_(channel_ids), cls.id.in_(thread_ids))
+        )).order_by(cls.channel_id, cls.id)
+        rv = {}
+        wanted = set(threads)
+        for message in query:
+            # The parent's own id identifies the thread, whatever it's thread_id
+            key = (message.channel_id, message.id)
+            if key not in wanted:
+                key = (message.channel_id, message.thread_id)
+            if key in wanted:
+                rv.setdefault(key, []).append(message)
+        return rv
+
+    @classmethod
+    def search_backend(cls):
+        """Return how message content can be searched, SQL Server's full-text 
+        index (`fulltext`, see migration 8b3d5f0e2a61) or SQLite's FTS5 table
+        (`fts5`, made along with sl_messages) when they exist, or failing that
+        a `like` scan.
+        """
+        if cls.__search_backend__ is None:
+            dialect = db.engine.dialect.name
+            if dialect == 'mssql':
+                found = db.session.execute(text(
+                    'SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID(:name)'
+                ), dict(name=cls.__tablename__)).scalar()
+                cls.__search_backend__ = 'fulltext' if found else 'like'
+            elif dialect == 'sqlite':
+                found = db.session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), dict(name=f'{cls.__tablename__}_fts')).scalar()
+                cls.__search_backend__ = 'fts5' if found else 'like'
+            else:
+                cls.__search_backend__ = 'like'
+        return cls.__search_backend__
+
+    @classmethod
+    def search(cls, q, per_page, page=1, after=None, **kwargs):
+        """Find the messages matching all the words of the given search, best 
+        matches first. Results are paged back by page number, or when given 
+        `after` keyset values (empty for the first page) by keyset cursor.
+        Only whole words are matched, except with the `like` fallback.
+        """
+        terms = re.findall(r'\w+', q or '')[:10]
+        if not terms:
+            raise BadRequest('Invalid search, q must contain at least one word')
+
+        query = cls.query
+        if kwargs:
+            query = query.filter_by(**kwargs)
+        backend = cls.search_backend()
+        if backend == 'fulltext':
+            condition = ' AND '.join(f'"{term}"' for term in terms)
+            matches = func.containstable(literal_column(cls.__tablename__), literal_column('content'), condition).alias('ft')
+            query = query.join(matches, literal_column('ft.[KEY]') == cls.__table__.c.search_id)
+            rank = literal_column('ft.RANK')
+        elif backend == 'fts5':
+            matches = table(f'{cls.__tablename__}_fts', column('rowid'), column('rank'))
+            query = query.join(matches, matches.c.rowid == literal_column(f'{cls.__tablename__}.rowid')) \
+                .filter(literal_column(matches.name).match(' '.join(f'"{term}"' for term in terms)))
+            # FTS5's rank is lower for better matches
+            rank = -matches.c.rank
+        else:
+            query = query.filter(*[cls.content.like(f'%{term}%') for term in terms])
+            rank = None
+
+        # Best matches first, then newest first
+        keys = [cls.id, cls.channel_id]
+        if rank is not None:
+            keys.insert(0, rank)
+            query = query.add_columns(rank)
+        if after:
+            if len(after) != len(keys):
+                raise BadRequest('Cursor does not match the requested search')
+            query = query.filter(cls._keyset_after(keys, after, 'desc'))
+        query = query.order_by(*[key.desc() for key in keys])
+
+        def message(row):
+            return row if rank is None else row[0]
+
+        if after is not None:
+            rows = query.limit(per_page + 1).all()
+            next = None
+            if len(rows) > per_page:
+                rows = rows[:per_page]
+                last = rows[-1]
+                next = [message(last).id, message(last).channel_id]
+                if rank is not None:
+                    next.insert(0, last[1])
+            return dict(per_page=per_page, items=[message(row) for row in rows], next=next)
+
+        rows = query.limit(per_page).offset((page - 1) * per_page).all()
+        if not rows and page != 1:
+            raise NotFound()
+        return dict(page=page, per_page=per_page, items=[message(row) for row in rows])
+
+
+
+# The migrations are SQL Server's, SQLite databases (e.g the tests') are made by
+# create_all, which also adds an external content FTS5 table over sl_messages,
+# kept in sync by triggers, for search_backend
+for statement in (
+        "CREATE VIRTUAL TABLE sl_messages_fts USING fts5(content, content='sl_messages', content_rowid='rowid')",
+        """
+        CREATE TRIGGER sl_messages_fts_ai AFTER INSERT ON sl_messages BEGIN
+            INSERT INTO sl_messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END""",
+        """
+        CREATE TRIGGER sl_messages_fts_ad AFTER DELETE ON sl_messages BEGIN
+            INSERT INTO sl_messages_fts (sl_messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END""",
+        """
+        CREATE TRIGGER sl_messages_fts_au AFTER UPDATE ON sl_messages BEGIN
+            INSERT INTO sl_messages_fts (sl_messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO sl_messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END"""):
+    event.listen(SlackMessage.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(SlackMessage.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS sl_messages_fts').execute_if(dialect='sqlite'))
+
 
 class SlackFile(BaseModel, db.Model):
     __tablename__ = 'sl_files'
     __default_sort__ = 'channel_id'
+    __sortable__ = ('channel_id', 'message_id')
+    __dataset__ = 'messages'
     __json_exclude__ = []
 
     message_id = db.Column(db.ForeignKey('sl_messages.id'), primary_key=True)
@@ -187,12 +622,19 @@ class SlackFile(BaseModel, db.Model):
     __table_args__ = (
         ForeignKeyConstraint([message_id, channel_id],
                              [SlackMessage.id, SlackMessage.channel_id]),
+        # Filtering by channel_id, or sorting by it (the default sort), followed
+        # by the rest of the primary key. Filtering by message_id, or sorting by
+        # it, is served by the primary key. SQL Server adds the clustered key 
+        # (so url) to the index anyway, SQLite needs it listed.
+        db.Index('ix_sl_files_channel_id_message_id_url', 'channel_id', 'message_id', 'url'),
     )
 
 
 class SlackEmoji(BaseModel, db.Model):
     __tablename__ = 'sl_emojis'
     __default_sort__ = 'id'
+    __sortable__ = ('id',)
+    __dataset__ = 'messages'
 
     id = db.Column(db.String(255), primary_key=True)
     url = db.Column(db.String(2048), nullable=False, index=True)
@@ -201,6 +643,8 @@ class SlackEmoji(BaseModel, db.Model):
 class SlackReaction(BaseModel, db.Model):
     __tablename__ = 'sl_reactions'
     __default_sort__ = 'user_id'
+    __sortable__ = ('user_id',)
+    __dataset__ = 'messages'
     __json_exclude__ = ['message_id', 'channel_id']
 
     message_id = db.Column(db.ForeignKey('sl_messages.id'), primary_key=True)
@@ -215,9 +659,103 @@ class SlackReaction(BaseModel, db.Model):
     __table_args__ = (
         ForeignKeyConstraint([message_id, channel_id],
                              [SlackMessage.id, SlackMessage.channel_id]),
+        # The ingester recounts the reactor and emoji stats by these
+        db.Index('ix_sl_reactions_user_id', 'user_id'),
+        db.Index('ix_sl_reactions_emoji_id', 'emoji_id'),
+    )
+
+
+class StatChannelDay(BaseModel, db.Model):
+    """Number of messages posted in each channel, per (UTC) day. Like the other
+    stats, kept up to date by the ingester as it loads messages.
+    """
+    __tablename__ = 'st_channel_days'
+    __default_sort__ = 'day'
+    __sortable__ = ('day', 'channel_id')
+    __dataset__ = 'messages'
+
+    channel_id = db.Column(db.ForeignKey('sl_channels.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def count(cls):
+        return super().count(id=cls.channel_id)
+
+    __table_args__ = (
+        db.Index('ix_st_channel_days_day', 'day', 'channel_id'),
     )
 
 
+class StatReactor(BaseModel, db.Model):
+    """Number of reactions each user has made."""
+    __tablename__ = 'st_reactors'
+    __default_sort__ = 'reactions'
+    __sortable__ = ('reactions', 'user_id')
+    __dataset__ = 'messages'
+
+    user_id = db.Column(db.String(11), primary_key=True)
+    reactions = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def count(cls):
+        return super().count(id=cls.user_id)
+
+    __table_args__ = (
+        db.Index('ix_st_reactors_reactions', 'reactions', 'user_id'),
+    )
+
+
+class StatEmoji(BaseModel, db.Model):
+    """Number of times each emoji has been used in a reaction."""
+    __tablename__ = 'st_emojis'
+    __default_sort__ = 'reactions'
+    __sortable__ = ('reactions', 'emoji_id')
+    __dataset__ = 'messages'
+
+    emoji_id = db.Column(db.String(255), primary_key=True)
+    reactions = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def count(cls):
+        return super().count(id=cls.emoji_id)
+
+    __table_args__ = (
+        db.Index('ix_st_emojis_reactions', 'reactions', 'emoji_id'),
+    )
+
+
+class StatUserActivity(BaseModel, db.Model):
+    """Number of messages each user has posted, and their latest one."""
+    __tablename__ = 'st_user_activity'
+    __default_sort__ = 'messages'
+    __sortable__ = ('messages', 'user_id')
+    __dataset__ = 'messages'
+
+    user_id = db.Column(db.ForeignKey('sl_users.id'), primary_key=True)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    last_message_id = db.Column(db.String(17), nullable=False)
+
+    @classmethod
+    def count(cls):
+        return super().count(id=cls.user_id)
+
+    __table_args__ = (
+        db.Index('ix_st_user_activity_messages', 'messages', 'user_id'),
+    )
+
+    @classmethod
+    def by_tz_offset(cls):
+        """Return the number of active users (those who've posted) and their 
+        messages, per timezone offset.
+        """
+        rows = db.session.query(SlackUser.tz_offset, func.count(cls.user_id), func.sum(cls.messages)) \
+            .join(SlackUser, SlackUser.id == cls.user_id) \
+            .group_by(SlackUser.tz_offset) \
+            .order_by(SlackUser.tz_offset)
+        return [dict(tz_offset=tz_offset, users=users, messages=messages) for tz_offset, users, messages in rows]
+
+
 class User(BaseModel, db.Model):
     __tablename__ = 'users'
 
@@ -237,3 +775,12 @@ class Application(BaseModel, db.Model):
     description = db.Column(db.Unicode(255))
     token = db.Column(db.String(43), nullable=False, index=True)
     deleted = db.Column(db.Boolean, index=True, nullable=False, default=False)
+
+    @classmethod
+    def find_active_by_token(cls, token):
+        """Return the application with the given token, if neither it or it's
+        owning user has been deleted.
+        """
+        return cls.query.join(User, User.id == cls.user_id) \
+            .filter(cls.token == token, cls.deleted == False, User.deleted == False) \
+            .first()
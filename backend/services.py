@@ -1,13 +1,17 @@
+import hashlib
 
 from azure.storage.blob import generate_container_sas, ContainerSasPermissions, BlobSasPermissions, BlobServiceClient
 from authlib.integrations.flask_client import OAuth
 from flask_caching import Cache
 from datetime import datetime, timedelta, timezone
 
-from backend.models import Application, SlackEmoji, SlackFile, SlackMessage, SlackReaction, User, SlackUser, SlackChannel
+from backend.helpers import LRUCache, decode_cursor, encode_cursor
+from backend.models import Application, DataVersion, SlackEmoji, SlackFile, SlackMessage, SlackReaction, User, SlackUser, SlackChannel, \
+    StatChannelDay, StatEmoji, StatReactor, StatUserActivity
 
 
-cache = Cache(config={'CACHE_TYPE': 'simple'})
+# Configured by the CACHE_* settings
+cache = Cache()
 
 
 class StorageService:
@@ -49,20 +53,105 @@ class BaseService:
     __model__ = None
 
     def init_app(self, app):
-        pass
+        self.count_cache_timeout = app.config['COUNT_CACHE_TIMEOUT']
 
     def count(self):
         return self.__model__.count()
 
+    def count_by(self, total='exact', **kwargs):
+        """Return the number of models specified by the given parameters, 
+        either an `exact` count, an `estimate` (exact when filtered) or `none`.
+        Counts are cached until they expire or the ingester loads new data.
+        """
+        if total == 'none':
+            return None
+        if kwargs:
+            total = 'exact'
+        version = data_version_service.get(self.__model__.__dataset__)
+        filters = '&'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))
+        key = f'count/{self.__model__.__tablename__}/{version}/{total}?{filters}'
+        rv = cache.get(key)
+        if rv is None:
+            if total == 'estimate':
+                rv = self.__model__.estimate_count()
+            else:
+                rv = self.__model__.count_by(**kwargs)
+            cache.set(key, rv, timeout=self.count_cache_timeout)
+        return rv
+
     def create(self, **kwargs):
         return self.__model__.create(**kwargs)
 
-    def find_all_with_paging(self, page, per_page, **kwargs):
-        print(f'page={page}, per={per_page}')
-        return self.__model__.find_all_with_paging(
+    def find_all_by_ids(self, ids):
+        """Return the models with the given ids that exist, in the given order."""
+        found = {model.id: model for model in self.__model__.find_all_by_ids(ids)}
+        return [found[id] for id in ids if id in found]
+
+    def find_all_with_paging(self, page, per_page, after=None, sort=None, sort_dir=None, total=None, fields=None, **kwargs):
+        """Page through the models, by page number or when given an `after` 
+        cursor token (empty for the first page), by keyset cursor. The total 
+        defaults to `exact` for page numbers and `none` for cursors. Only the
+        given fields (and ids) are selected, when given.
+        """
+        if after is not None:
+            rv = self.__model__.find_all_with_cursor(
+                per_page=per_page,
+                after=decode_cursor(after),
+                sort=sort,
+                sort_dir=sort_dir,
+                fields=fields,
+                **kwargs)
+            rv['next'] = encode_cursor(rv['next']) if rv['next'] else None
+            if total and total != 'none':
+                rv['total'] = self.count_by(total, **kwargs)
+            return rv
+        rv = self.__model__.find_all_with_paging(
             page=page, 
             per_page=per_page,
+            sort=sort,
+            sort_dir=sort_dir,
+            fields=fields,
             **kwargs)
+        rv['total'] = self.count_by(total or 'exact', **kwargs)
+        return rv
+
+    def iter_all(self, batch_size=500, **kwargs):
+        """Iterate through all the models specified by the given parameters, 
+        yielding them in batches of batch_size. Each batch is a keyset page
+        (see find_all_with_cursor), so only one batch is held in memory and
+        each costs the same to fetch no matter how far through we are.
+        """
+        after = None
+        while True:
+            rv = self.__model__.find_all_with_cursor(per_page=batch_size, after=after, **kwargs)
+            if rv['items']:
+                yield rv['items']
+            after = rv['next']
+            if not after:
+                return
+
+
+class DataVersionService(BaseService):
+    """Encapsulates `DataVersion` model operations.
+    """
+    __model__ = DataVersion
+
+    def init_app(self, app):
+        self.timeout = app.config['DATA_VERSION_CACHE_TIMEOUT']
+
+    def get(self, name):
+        """Return the current version of the given data set, we only check
+        the database once every DATA_VERSION_CACHE_TIMEOUT seconds, or after
+        the ingester drops the cached version (see ingester support.cache).
+        """
+        if not name:
+            return 0
+        key = f'data_version/{name}'
+        version = cache.get(key)
+        if version is None:
+            version = self.__model__.get_version(name)
+            cache.set(key, version, timeout=self.timeout)
+        return version
 
 
 class UserService(BaseService):
@@ -82,15 +171,41 @@ class ApplicationService(BaseService):
     """
     __model__ = Application
 
+    def init_app(self, app):
+        super().init_app(app)
+        # Authorized tokens (by hash) to their application id and user_id
+        self.token_cache = LRUCache(
+            maxsize=app.config['API_KEY_CACHE_SIZE'], 
+            ttl=app.config['API_KEY_CACHE_TIMEOUT'])
+
     def all_by_user(self, user_id):
         return self.__model__.find_all(user_id=user_id, deleted=False)
 
     def soft_delete_by_user(self, id, user_id):
         self.__model__.update_by(filters=dict(id=id, user_id=user_id), deleted=True)
+        self.token_cache.delete_where(lambda app: str(app['id']) == str(id))
+
+    def uncache_user_tokens(self, user_id):
+        """Drop the cached tokens for all of the given user's applications.
+        """
+        self.token_cache.delete_where(lambda app: app['user_id'] == user_id)
 
     def authorize(self, token):
-        return self.__model__.find_one(token=token)
-        
+        """Return the id and user_id of the active application with the given
+        token, or None if there isn't one. Authorized tokens are cached for
+        API_KEY_CACHE_TIMEOUT seconds, so other processes may keep accepting
+        a deleted token until then.
+        """
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        rv = self.token_cache.get(key)
+        if rv is None:
+            app = self.__model__.find_active_by_token(token)
+            if not app:
+                return None
+            rv = dict(id=app.id, user_id=app.user_id)
+            self.token_cache.set(key, rv)
+        return rv
+
 
 class SlackUserService(BaseService):
     __model__ = SlackUser
@@ -101,8 +216,50 @@ class SlackChannelService(BaseService):
 class SlackMessageService(BaseService):
     __model__ = SlackMessage
 
-    def get_by_id(self, channel_id, message_id):
-        return self.__model__.get(channel_id, message_id)
+    def get_by_id(self, channel_id, message_id, include=('files', 'reactions')):
+        message = self.__model__.get(channel_id, message_id)
+        if message:
+            self.__model__.load_related([message], include)
+        return message
+
+    def find_all_with_paging(self, page, per_page, include=('files', 'reactions'), **kwargs):
+        rv = super().find_all_with_paging(page, per_page, **kwargs)
+        self.__model__.load_related(rv['items'], include)
+        return rv
+
+    def iter_all(self, batch_size=500, include=('files', 'reactions'), **kwargs):
+        for messages in super().iter_all(batch_size, **kwargs):
+            yield self.__model__.load_related(messages, include)
+
+    def find_all_by_keys(self, keys, include=('files', 'reactions')):
+        """Return the messages with the given (channel_id, id) keys that exist,
+        in the given order, with their included relationships loaded.
+        """
+        found = self.__model__.find_all_by_keys(keys)
+        rv = [found[key] for key in keys if key in found]
+        self.__model__.load_related(rv, include)
+        return rv
+
+    def find_threads(self, threads, include=('files', 'reactions')):
+        """Return the messages of each of the given (channel_id, thread_id) 
+        threads found, with their included relationships loaded.
+        """
+        rv = self.__model__.find_threads(threads)
+        self.__model__.load_related([m for messages in rv.values() for m in messages], include)
+        return rv
+
+    def search(self, q, page, per_page, after=None, include=('files', 'reactions'), **kwargs):
+        """Search the messages content (see SlackMessage.search), by page number
+        or when given an `after` cursor token, by keyset cursor. Search results 
+        aren't counted.
+        """
+        if after is not None:
+            rv = self.__model__.search(q, per_page, after=decode_cursor(after), **kwargs)
+            rv['next'] = encode_cursor(rv['next']) if rv['next'] else None
+        else:
+            rv = self.__model__.search(q, per_page, page=page, **kwargs)
+        self.__model__.load_related(rv['items'], include)
+        return rv
 
 
 class SlackEmojiService(BaseService):
@@ -114,7 +271,23 @@ class SlackFileService(BaseService):
 class SlackReactionService(BaseService):
     __model__ = SlackReaction
 
+class StatChannelDayService(BaseService):
+    __model__ = StatChannelDay
+
+class StatReactorService(BaseService):
+    __model__ = StatReactor
+
+class StatEmojiService(BaseService):
+    __model__ = StatEmoji
+
+class StatUserActivityService(BaseService):
+    __model__ = StatUserActivity
 
+    def by_tz_offset(self):
+        return self.__model__.by_tz_offset()
+
+
+data_version_service = DataVersionService()
 user_service = UserService()
 app_service = ApplicationService()
 
@@ -127,5 +300,10 @@ slackemoji_service = SlackEmojiService()
 slackfile_service = SlackFileService()
 slackreaction_service = SlackReactionService()
 
+statchannelday_service = StatChannelDayService()
+statreactor_service = StatReactorService()
+statemoji_service = StatEmojiService()
+statuseractivity_service = StatUserActivityService()
+
 oauth_service = OAuth()
 
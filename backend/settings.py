@@ -24,6 +24,20 @@ class Config:
     APP_LOG_LVL = os.environ.get('LOG_LVL', logging.WARN)
     URLLIB_LOG_LVL = os.environ.get('URLLIB_LOG_LVL', logging.WARN)
     AZURE_LOG_LVL = os.environ.get('AZURE_LOG_LVL', logging.WARN)
+    # INFO logs every SQL statement, see /metrics for SQL counts and timings instead
+    SQL_LOG_LVL = os.environ.get('SQL_LOG_LVL', logging.WARN)
+
+    # Expose /metrics, unauthenticated, so only where it can't be reached publicly
+    METRICS_ENABLED = _getbool_from_str(os.environ.get('METRICS_ENABLED'))
+    # Add a Server-Timing header (db, serialize and total time) to every response
+    METRICS_SERVER_TIMING = _getbool_from_str(os.environ.get('METRICS_SERVER_TIMING'))
+
+    # Log statements taking at least this many milliseconds (0 to disable), and 
+    # warn when a request runs the same statement more than this many times (0 
+    # to disable), e.g a relationship being loaded one model at a time (N+1). 
+    # When TESTING, the repeated statement raises instead.
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 500))
+    REPEATED_STATEMENT_LIMIT = int(os.environ.get('REPEATED_STATEMENT_LIMIT', 10))
 
     SLACK_TEAM = os.environ.get('SLACK_TEAM')
 
@@ -55,9 +69,47 @@ class Config:
     DB_SERVER_HOST = os.environ.get('DB_SERVER_HOST')
     DB_ODBC_URI = f'DRIVER={DB_DRIVER};SERVER={DB_SERVER_HOST};PORT={DB_SERVER_PORT};DATABASE={DB_DATABASE};UID={DB_USERNAME};PWD={DB_PASSWORD}'
 
-    SQLALCHEMY_DATABASE_URI = f'mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(DB_ODBC_URI)}'
+    # Defaults to the SQL Server configured above, override e.g to run the benchmarks against SQLite
+    SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI',
+        f'mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(DB_ODBC_URI)}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Engine connection pool, per worker process (see init_app). Connections are 
+    # recycled before App Service's load balancer silently drops them for being 
+    # idle (4 mins), and pinged on checkout in case they were dropped anyway
+    ENGINE_POOL_SIZE = int(os.environ.get('ENGINE_POOL_SIZE', 5))
+    ENGINE_MAX_OVERFLOW = int(os.environ.get('ENGINE_MAX_OVERFLOW', 5))
+    ENGINE_POOL_TIMEOUT = int(os.environ.get('ENGINE_POOL_TIMEOUT', 10))
+    ENGINE_POOL_RECYCLE = int(os.environ.get('ENGINE_POOL_RECYCLE', 200))
+    ENGINE_POOL_PRE_PING = _getbool_from_str(os.environ.get('ENGINE_POOL_PRE_PING', 'true'))
+    # pyodbc only, SQLAlchemy's pool makes the ODBC driver manager's pooling redundant
+    ENGINE_FAST_EXECUTEMANY = _getbool_from_str(os.environ.get('ENGINE_FAST_EXECUTEMANY', 'true'))
+    ENGINE_ODBC_POOLING = _getbool_from_str(os.environ.get('ENGINE_ODBC_POOLING', 'false'))
+
+    # Cache backend (see Flask-Caching), use redis to share the cache between 
+    # workers and instances, which also lets the ingester invalidate it
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'ubtsapi/')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))
+
+    # Seconds to cache paginated totals, and how often to check if the ingester 
+    # has loaded new data (which invalidates the cached totals)
+    COUNT_CACHE_TIMEOUT = int(os.environ.get('COUNT_CACHE_TIMEOUT', 3600))
+    DATA_VERSION_CACHE_TIMEOUT = int(os.environ.get('DATA_VERSION_CACHE_TIMEOUT', 60))
+
+    # Seconds clients (and proxies, per API key) may reuse a resource response, 
+    # and seconds we cache the response ourselves
+    RESOURCE_CACHE_MAX_AGE = int(os.environ.get('RESOURCE_CACHE_MAX_AGE', 60))
+    RESOURCE_CACHE_TIMEOUT = int(os.environ.get('RESOURCE_CACHE_TIMEOUT', 600))
+
+    # Number of API keys to cache per process, and for how many seconds
+    API_KEY_CACHE_SIZE = int(os.environ.get('API_KEY_CACHE_SIZE', 1024))
+    API_KEY_CACHE_TIMEOUT = int(os.environ.get('API_KEY_CACHE_TIMEOUT', 60))
+
+    # Max number of items (e.g, threads) a batch request can ask for at once
+    BATCH_GET_MAX_ITEMS = int(os.environ.get('BATCH_GET_MAX_ITEMS', 50))
+
     BLOB_ACCOUNT_NAME = os.environ.get('BLOB_ACCOUNT_NAME')
     BLOB_DATASET_CONTAINER_NAME = os.environ.get('BLOB_DATASET_CONTAINER_NAME')
     BLOB_ACCOUNT_KEY = os.environ.get('BLOB_ACCOUNT_KEY')
@@ -78,5 +130,20 @@ class Config:
             else: 
                 raise EnvironmentError(message)
 
+        # Pool options don't apply to SQLite, which Flask-SQLAlchemy gives a NullPool
+        self.SQLALCHEMY_ENGINE_OPTIONS = {}
+        if not self.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+            self.SQLALCHEMY_ENGINE_OPTIONS.update(
+                pool_size=self.ENGINE_POOL_SIZE,
+                max_overflow=self.ENGINE_MAX_OVERFLOW,
+                pool_timeout=self.ENGINE_POOL_TIMEOUT,
+                pool_recycle=self.ENGINE_POOL_RECYCLE,
+                pool_pre_ping=self.ENGINE_POOL_PRE_PING)
+        if self.SQLALCHEMY_DATABASE_URI.startswith('mssql+pyodbc'):
+            import pyodbc
+            # Must be set before the first connection is made
+            pyodbc.pooling = self.ENGINE_ODBC_POOLING
+            self.SQLALCHEMY_ENGINE_OPTIONS['fast_executemany'] = self.ENGINE_FAST_EXECUTEMANY
+
         # No missing or ignoring missing configs
         app.config.from_object(self)
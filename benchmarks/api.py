@@ -0,0 +1,168 @@
+"""
+Measure the latency (p50/p95/p99) and throughput of the API endpoints, driving
+the app through it's WSGI test client against a synthetic dataset (see dataset.py).
+
+Usage: python benchmarks/api.py [--messages 1000000] [--requests 200] [--concurrency 1] [--output results.json]
+
+The dataset is built on the first run (which takes a while for millions of
+messages) and reused after that. Response caching is off unless --cache is
+given, so every request reaches the database. Results are written as JSON,
+tagged with the current commit, so runs can be compared across commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dataset
+
+_api = '/api/resource/slack'
+
+
+def cases(sample, messages):
+    """Return the (name, path for the i'th request, needs a signed in session)
+    to benchmark, paths pick from the given sample of (channel_id, message_id,
+    user_id) messages so requests don't all hit the same rows.
+    """
+    from backend.helpers import encode_cursor
+    middle_page = max(1, messages // 50 // 2)
+
+    def pick(i):
+        return sample[i % len(sample)]
+
+    return [
+        ('list_users', lambda i: f'{_api}/users', False),
+        ('list_users sorted page 20', lambda i: f'{_api}/users?sort=tz_offset,desc&page=20', False),
+        ('list_channels', lambda i: f'{_api}/channels', False),
+        ('list_emojis', lambda i: f'{_api}/emojis', False),
+        ('list_files', lambda i: f'{_api}/files', False),
+        ('list_files by channel', lambda i: f'{_api}/files?channel_id={pick(i)[0]}', False),
+        ('list_messages', lambda i: f'{_api}/messages?per_page=50', False),
+        ('list_messages middle page', lambda i: f'{_api}/messages?page={middle_page}', False),
+        ('list_messages after cursor', lambda i: f'{_api}/messages?after={encode_cursor(list(pick(i)[1::-1]))}', False),
+        ('list_messages by channel with files, reactions',
+            lambda i: f'{_api}/messages?channel_id={pick(i)[0]}&include=files,reactions', False),
+        ('list_messages by user', lambda i: f'{_api}/messages?user_id={pick(i)[2]}', False),
+        ('get_message', lambda i: f'{_api}/messages/{pick(i)[0]}/{pick(i)[1]}', False),
+        ('datasets', lambda i: '/api/datasets', True),
+    ]
+
+
+def _sample(app, size, seed):
+    from backend.datastores import db
+    with app.app_context():
+        # search_ids aren't necessarily 1..N, e.g an IDENTITY column after deletes
+        search_ids = [row[0] for row in db.session.execute('SELECT search_id FROM sl_messages ORDER BY search_id')]
+        ids = random.Random(seed).sample(search_ids, min(size, len(search_ids)))
+        rows = db.session.execute(
+            'SELECT channel_id, id, user_id FROM sl_messages WHERE search_id IN ({})'.format(','.join(map(str, ids))))
+        return sorted(tuple(row) for row in rows)
+
+
+def _client(app, session):
+    from backend import auth
+    client = app.test_client()
+    if session:
+        with client.session_transaction() as sess:
+            sess[auth.key_auth_user] = dict(name='benchmark', **{auth.key_is_verified: True})
+    return client
+
+
+def _percentile(timings, p):
+    """Nearest rank percentile of the given sorted timings."""
+    return timings[max(0, int(round(p / 100 * len(timings))) - 1)]
+
+
+def run(app, name, path, session, requests, concurrency, warmup):
+    headers = {'Authorization': dataset.TOKEN}
+    client = _client(app, session)
+    for i in range(warmup):
+        resp = client.get(path(i), headers=headers)
+        if resp.status_code != 200:
+            return dict(name=name, error=f'{resp.status_code}: {resp.get_data(as_text=True)[:200]}')
+
+    def worker(indexes):
+        client = _client(app, session)
+        timings, errors = [], 0
+        for i in indexes:
+            url = path(i)
+            start = time.perf_counter()
+            resp = client.get(url, headers=headers)
+            resp.get_data()
+            timings.append(time.perf_counter() - start)
+            errors += resp.status_code != 200
+        return timings, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(worker, [range(warmup + w, warmup + requests, concurrency) for w in range(concurrency)]))
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(t for ts, _ in results for t in ts)
+    return dict(
+        name=name,
+        path=path(0),
+        requests=len(timings),
+        errors=sum(e for _, e in results),
+        p50_ms=round(_percentile(timings, 50) * 1000, 2),
+        p95_ms=round(_percentile(timings, 95) * 1000, 2),
+        p99_ms=round(_percentile(timings, 99) * 1000, 2),
+        mean_ms=round(sum(timings) / len(timings) * 1000, 2),
+        requests_per_sec=round(len(timings) / elapsed, 1))
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--database-uri', help='(default: a SQLite file in benchmarks/data)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='requests per endpoint before measuring')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads making requests')
+    parser.add_argument('--cache', action='store_true', help='leave response caching on')
+    parser.add_argument('--only', help='only run endpoints whose name contains this')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    args = parser.parse_args()
+
+    uri = args.database_uri or dataset.default_uri(args.messages)
+    app = dataset.create_app(uri, cache=args.cache)
+    dataset.ensure(app, uri, args.messages, args.seed)
+    sample = _sample(app, 1000, args.seed)
+
+    results = []
+    for name, path, session in cases(sample, args.messages):
+        if args.only and args.only not in name:
+            continue
+        result = run(app, name, path, session, args.requests, args.concurrency, args.warmup)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = dict(
+        commit=_commit(),
+        created_at=datetime.datetime.utcnow().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        database=app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        messages=args.messages,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        cache=args.cache,
+        results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,175 @@
+"""
+Build a synthetic Slack dataset (users, channels, emojis, and messages with
+threads, files and reactions) for the benchmarks to run against.
+
+Usage: python benchmarks/dataset.py [--messages 1000000] [--database-uri sqlite:///benchmarks/data/slack-1000000.db]
+
+The generator is seeded, so the same arguments always build the same data.
+SQLite databases are created from the models, other databases (e.g the
+docker-compose SQL Server) must already be migrated and have no Slack data.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# API key of the benchmark application
+TOKEN = 'benchmark'
+
+USERS = 2500
+CHANNELS = 100
+EMOJIS = 300
+
+_words = ('the build is green again', 'anyone else stuck on', 'lesson', 'quiz', 'project', 'kubernetes',
+          'azure', 'docker', 'container', 'deadline', 'thanks', 'great job', 'help', 'error', 'deploy',
+          'pipeline', 'study jam', 'scholarship', 'phase 2', 'congrats', 'question', 'solved', 'link')
+
+
+def default_uri(messages):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f'slack-{messages}.db')
+    return f'sqlite:///{path}'
+
+
+def create_app(database_uri, cache=False):
+    """Create the app against the given database, with debug off and (unless
+    asked for) response caching off, so requests are measured end to end.
+    """
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri
+    os.environ['FLASK_DEBUG'] = 'false'
+    if not cache:
+        os.environ['CACHE_TYPE'] = 'null'
+    from backend import factory
+    return factory.create_app()
+
+
+def message_id(i):
+    return f'{1577836800 + i * 7}.{i % 1000000:06d}'
+
+
+def channel_id(i):
+    return f'C{i % CHANNELS:010d}'
+
+
+def user_id(i):
+    return f'U{i % USERS:010d}'
+
+
+def _users(rng, now):
+    for i in range(USERS):
+        yield dict(id=user_id(i), name=f'user{i}', full_name=f'User {i}', archived_at=now,
+                   tz_offset=f'UTC{rng.choice("+-")}{rng.randint(0, 12):02d}:00')
+
+
+def _channels(rng, now):
+    for i in range(CHANNELS):
+        yield dict(id=channel_id(i), name=f'channel-{i}', description=f'Channel {i}', archived_at=now)
+
+
+def _emojis(rng, now):
+    for i in range(EMOJIS):
+        yield dict(id=f':emoji-{i}:', url=f'https://emoji.slack-edge.com/T0000/emoji-{i}.png')
+
+
+def _messages(rng, count, search_ids=True):
+    """Yield (message, files, reactions) rows. About 10% of messages start a
+    thread, 30% reply to one of their channel's recent threads, 10% have a
+    file and 20% have reactions. Without search_ids, the database numbers
+    the messages (on SQL Server, search_id is an IDENTITY column).
+    """
+    threads = {}
+    for i in range(count):
+        mid, ch = message_id(i), channel_id(rng.randrange(CHANNELS))
+        thread_id = None
+        roll = rng.random()
+        if roll < 0.1:
+            thread_id = mid
+            threads.setdefault(ch, []).append(mid)
+            del threads[ch][:-5]
+        elif roll < 0.4 and threads.get(ch):
+            thread_id = rng.choice(threads[ch])
+        msg = dict(id=mid, channel_id=ch, thread_id=thread_id, user_id=user_id(rng.randrange(USERS)),
+                   content=' '.join(rng.choice(_words) for _ in range(rng.randint(3, 30))),
+                   deleted=False)
+        if search_ids:
+            msg['search_id'] = i + 1
+        files = [dict(message_id=mid, channel_id=ch, url=f'https://files.slack.com/files-pri/T0000/F{i:08d}/image.png')] \
+            if rng.random() < 0.1 else []
+        reactions = []
+        if rng.random() < 0.2:
+            for user, emoji in {(user_id(rng.randrange(USERS)), rng.randrange(EMOJIS)) for _ in range(rng.randint(1, 3))}:
+                reactions.append(dict(message_id=mid, channel_id=ch, user_id=user, emoji_id=f':emoji-{emoji}:'))
+        yield msg, files, reactions
+
+
+def build(app, messages, seed=0, chunk_size=10000):
+    """Load the synthetic dataset, with the given number of messages, into the
+    app's database.
+    """
+    from backend import models
+    from backend.datastores import db
+
+    rng = random.Random(seed)
+    now = datetime.datetime(2021, 1, 1)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            db.create_all()
+        user = models.User(oa_id='benchmark', oa_provider='github', name='benchmark')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(models.Application(user_id=user.id, name='benchmark', token=TOKEN))
+        for model, rows in ((models.SlackUser, _users), (models.SlackChannel, _channels), (models.SlackEmoji, _emojis)):
+            db.session.execute(model.__table__.insert(), list(rows(rng, now)))
+        db.session.commit()
+
+        start = time.perf_counter()
+        batch = ([], [], [])
+        search_ids = db.engine.dialect.name != 'mssql'
+        for i, (msg, files, reactions) in enumerate(_messages(rng, messages, search_ids), 1):
+            batch[0].append(msg)
+            batch[1].extend(files)
+            batch[2].extend(reactions)
+            if i % chunk_size == 0 or i == messages:
+                for model, rows in zip((models.SlackMessage, models.SlackFile, models.SlackReaction), batch):
+                    if rows:
+                        db.session.execute(model.__table__.insert(), rows)
+                        rows.clear()
+                db.session.commit()
+                print(f'{i}/{messages} messages ({time.perf_counter() - start:.0f}s)', file=sys.stderr)
+
+
+def ensure(app, database_uri, messages, seed=0):
+    """Build the dataset unless the database already has it (SQLite files are
+    kept between runs, named by message count).
+    """
+    if not database_uri.startswith('sqlite:///'):
+        from backend.datastores import db
+        with app.app_context():
+            if not db.session.execute('SELECT COUNT(*) FROM apps WHERE token = :token', dict(token=TOKEN)).scalar():
+                build(app, messages, seed)
+        return
+
+    path = database_uri[len('sqlite:///'):]
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        build(app, messages, seed)
+    except BaseException:
+        # Don't leave a half built dataset to be picked up by the next run
+        os.remove(path)
+        raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--database-uri', help='(default: a SQLite file in benchmarks/data)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    uri = args.database_uri or default_uri(args.messages)
+    ensure(create_app(uri), uri, args.messages, args.seed)
@@ -0,0 +1,142 @@
+"""
+Measure how long serializing API responses takes, with orjson (what the API
+uses when it's installed, see helpers.json_dumps) against Flask's json, on
+pages of the synthetic dataset (see dataset.py). As a baseline, the models are
+also serialized the way they were before serializers were compiled (see
+models.compile_serializer): walking the mapper's properties for every model,
+from the JSON encoder.
+
+Usage: python benchmarks/serialize.py [--messages 10000] [--repeat 200] [--output results.json]
+
+Pages are loaded once, so only serializing is measured: converting the models
+(their compiled serializers) and encoding the result. The baseline and both
+encoders are checked to give the same JSON before they're timed.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+
+import api
+import dataset
+
+
+def pages():
+    """Return the (name, response object) to serialize, as the list endpoints
+    return them.
+    """
+    from backend import services
+    from backend.datastores import db
+    rv = []
+    for name, service, kwargs in (
+            ('users page', services.slackuser_service, {}),
+            ('messages page', services.slackmessage_service, dict(include=())),
+            ('messages page with files, reactions', services.slackmessage_service, dict(include=('files', 'reactions')))):
+        rv.append((name, service.find_all_with_paging(page=1, per_page=50, total='none', **kwargs)))
+        # Otherwise the next page gets the same (identity mapped) models
+        db.session.expunge_all()
+    return rv
+
+
+def _flask_dumps(obj):
+    from flask import json
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _reflection_to_json(model):
+    """The old BaseModel.to_json, except that relationships which haven't been
+    loaded and columns which weren't selected are left out, as the compiled
+    serializers do, rather than loaded (one query per model).
+    """
+    rv = {}
+    loaded = model.__dict__
+    for prop in model.__mapper__.iterate_properties:
+        if prop.key not in model.__json_exclude__ and prop.key in loaded:
+            rv[prop.key] = getattr(model, prop.key)
+    return rv
+
+
+def _reflection_flask_dumps(obj):
+    """Flask json with the old JSON encoder, which serialized models (and
+    their related models) as it came across them.
+    """
+    from flask import json
+    from backend.models import BaseModel
+
+    class JSONEncoder(json.JSONEncoder):
+        def default(self, o):
+            if isinstance(o, BaseModel):
+                return _reflection_to_json(o)
+            return super().default(o)
+    return json.dumps(obj, cls=JSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+def _to_json(obj):
+    return [model.to_json() for model in obj['items']]
+
+
+def _time(func, obj, repeat):
+    """Median seconds per call, of repeat calls."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(obj)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run(app, repeat):
+    from backend import helpers
+    if helpers.orjson is None:
+        sys.exit('orjson is not installed')
+
+    results = []
+    with app.test_request_context():
+        for name, obj in pages():
+            expected = json.loads(_reflection_flask_dumps(obj))
+            if json.loads(_flask_dumps(obj)) != expected:
+                sys.exit(f'{name}: Flask json differs from the reflection baseline')
+            if json.loads(helpers.json_dumps(obj)) != expected:
+                sys.exit(f'{name}: orjson differs from the reflection baseline')
+            results.append(dict(
+                name=name,
+                items=len(obj['items']),
+                bytes=len(helpers.json_dumps(obj)),
+                reflection_flask_json_us=round(_time(_reflection_flask_dumps, obj, repeat) * 1e6),
+                to_json_us=round(_time(_to_json, obj, repeat) * 1e6),
+                flask_json_us=round(_time(_flask_dumps, obj, repeat) * 1e6),
+                orjson_us=round(_time(helpers.json_dumps, obj, repeat) * 1e6)))
+            print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--database-uri', help='(default: a SQLite file in benchmarks/data)')
+    parser.add_argument('--repeat', type=int, default=200, help='times each page is serialized')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    args = parser.parse_args()
+
+    uri = args.database_uri or dataset.default_uri(args.messages)
+    app = dataset.create_app(uri)
+    dataset.ensure(app, uri, args.messages, args.seed)
+
+    import orjson
+    report = dict(
+        commit=api._commit(),
+        created_at=datetime.datetime.utcnow().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        orjson=orjson.__version__,
+        messages=args.messages,
+        repeat=args.repeat,
+        results=run(app, args.repeat))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
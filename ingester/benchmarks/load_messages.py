@@ -0,0 +1,140 @@
+"""
+Compare loading a messages payload with the row by row statements the loader
+used to run (INSERT ... WHERE NOT EXISTS per message, file and reaction)
+against the staged, set based MERGE statements it runs now.
+
+Usage: python benchmarks/load_messages.py [--size-mb 10] [--batch-size 1000]
+
+Runs against the database in .env, e.g the docker-compose SQL Server, which must
+already be migrated. Synthetic channels and users are created for the messages
+to reference, and everything (including the payload's ledger entry) is
+removed again after each run.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from support import db, stream
+from stream_memory import generate
+
+import fn_load_messages
+
+# The row by row statements the loader used before switching to MERGE
+legacy_insert_emoji_stmt = """
+    INSERT INTO sl_emojis (id, url)
+        (SELECT ?, ? WHERE NOT EXISTS (
+            SELECT 1 FROM sl_emojis WHERE sl_emojis.id = ? AND sl_emojis.url = ?))
+"""
+
+legacy_insert_files_stmt = """
+    INSERT INTO sl_files (message_id, channel_id, url)
+        (SELECT ?,?,? WHERE NOT EXISTS (
+            SELECT 1 FROM sl_files
+            WHERE sl_files.message_id = ? AND sl_files.channel_id = ? AND url = ?))
+"""
+
+legacy_insert_reaction_stmt = """
+    INSERT INTO sl_reactions (message_id, channel_id, user_id, emoji_id)
+        (SELECT ?,?,?,? WHERE NOT EXISTS (
+            SELECT 1 FROM sl_reactions
+            WHERE sl_reactions.message_id = ? AND sl_reactions.channel_id = ?
+                AND sl_reactions.user_id = ? AND sl_reactions.emoji_id = ?))
+"""
+
+legacy_insert_msg_stmt = """
+    INSERT INTO sl_messages (id, channel_id, thread_id, user_id, content)
+        (SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (
+            SELECT 1 FROM sl_messages WHERE sl_messages.id = ? AND sl_messages.channel_id = ?))
+"""
+
+
+def load_legacy(path, batch_size):
+    with db.get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.fast_executemany = True
+            with open(path, 'rb') as f:
+                for _, msgs in stream.iter_batches(f, batch_size=batch_size):
+                    msg_data, file_data, emoji_data, react_data = [], [], [], []
+                    for msg in msgs:
+                        msg_data.append((msg['id'], msg['channel'], msg['thread'], msg['user'], msg['content'], msg['id'], msg['channel']))
+                        for furl in msg['files']:
+                            file_data.append((msg['id'], msg['channel'], furl) * 2)
+                        for emoji_id, emoji in msg['reactions'].items():
+                            emoji_data.append((emoji_id, emoji['url']) * 2)
+                            for user in emoji['users']:
+                                react_data.append((msg['id'], msg['channel'], user, emoji_id) * 2)
+                    cursor.executemany(legacy_insert_msg_stmt, msg_data)
+                    if file_data:
+                        cursor.executemany(legacy_insert_files_stmt, file_data)
+                    if emoji_data:
+                        cursor.executemany(legacy_insert_emoji_stmt, emoji_data)
+                    if react_data:
+                        cursor.executemany(legacy_insert_reaction_stmt, react_data)
+
+
+def load_merge(path, batch_size):
+    with open(path, 'rb') as f:
+        fn_load_messages.load_messages(f, batch_size=batch_size)
+
+
+def _seed(conn):
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO sl_channels (id, name, archived_at) VALUES (?, ?, getdate())",
+            [(f'C{i:010d}', f'bench-{i}') for i in range(97)])
+        cursor.executemany(
+            "INSERT INTO sl_users (id, name, archived_at) VALUES (?, ?, getdate())",
+            [(f'U{i:010d}', f'bench-{i}') for i in range(2441)])
+
+
+# The synthetic channels, users and emojis (see _seed and stream_memory)
+_bench_channels = "SELECT id FROM sl_channels WHERE id LIKE 'C00000%' AND name LIKE 'bench-%'"
+_bench_users = "SELECT id FROM sl_users WHERE id LIKE 'U00000%' AND name LIKE 'bench-%'"
+_bench_emojis = "SELECT id FROM sl_emojis WHERE url = 'https://a.slack-edge.com/+1.png'"
+
+
+def _cleanup(conn, path):
+    with conn.cursor() as cursor:
+        # Otherwise the ledger skips the payload as already loaded the next run
+        cursor.execute("DELETE FROM ingest_files WHERE dataset = 'messages' AND name = ?", path)
+        # First, the stats reference the channels and users
+        cursor.execute(f"DELETE FROM st_channel_days WHERE channel_id IN ({_bench_channels})")
+        cursor.execute(f"DELETE FROM st_user_activity WHERE user_id IN ({_bench_users})")
+        cursor.execute(f"DELETE FROM st_reactors WHERE user_id IN ({_bench_users})")
+        cursor.execute(f"DELETE FROM st_emojis WHERE emoji_id IN ({_bench_emojis})")
+        for table in ('sl_reactions', 'sl_files', 'sl_messages'):
+            cursor.execute(f"DELETE FROM {table} WHERE channel_id LIKE 'C00000%'")
+        cursor.execute("DELETE FROM sl_emojis WHERE url = 'https://a.slack-edge.com/+1.png'")
+        cursor.execute("DELETE FROM sl_users WHERE id LIKE 'U00000%' AND name LIKE 'bench-%'")
+        cursor.execute("DELETE FROM sl_channels WHERE id LIKE 'C00000%' AND name LIKE 'bench-%'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--path', help='payload to use (generated when missing)')
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.gettempdir(), f'ubtsct-messages-{args.size_mb}mb.json')
+    if not os.path.exists(path):
+        print(f'Generating {args.size_mb}MB payload at {path}')
+        generate(path, args.size_mb)
+
+    conn = db.get_conn()
+    for mode, load in (('row', load_legacy), ('merge', load_merge)):
+        _cleanup(conn, path)
+        _seed(conn)
+        start = time.perf_counter()
+        load(path, args.batch_size)
+        elapsed = time.perf_counter() - start
+        with conn.cursor() as cursor:
+            rows = cursor.execute("SELECT COUNT(*) FROM sl_messages WHERE channel_id LIKE 'C00000%'").fetchone()[0]
+        print(json.dumps(dict(mode=mode, batch_size=args.batch_size, messages=rows,
+                              seconds=round(elapsed, 2), messages_per_sec=round(rows / elapsed))))
+    _cleanup(conn, path)
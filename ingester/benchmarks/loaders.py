@@ -0,0 +1,161 @@
+"""
+Measure the throughput (records/sec), peak memory and SQL statements issued by
+each loader (channels, users and messages), loading payloads from payloads.py.
+
+Usage: python benchmarks/loaders.py [--messages 100000] [--batch-size 1000] [--output results.json]
+
+Runs against the database in .env, e.g the docker-compose SQL Server, which must
+already be migrated. Each loader runs in it's own process, so peak RSS is
+measured independently. The benchmark's data (and ledger entries) are removed
+before each run, and after unless --keep is given.
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import payloads
+from support import db
+
+_loaders = ('channels', 'users', 'messages')
+
+
+class _CountingCursor:
+    """Proxy for a pyodbc cursor, counting the statements executed with it."""
+    def __init__(self, cursor, counts):
+        self.__dict__.update(_cursor=cursor, _counts=counts)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+    def execute(self, stmt, *params):
+        self._counts['statements'] += 1
+        self._cursor.execute(stmt, *params)
+        return self
+
+    def executemany(self, stmt, params):
+        self._counts['statements'] += 1
+        self._counts['executemany_rows'] += len(params)
+        return self._cursor.executemany(stmt, params)
+
+
+class _CountingConnection:
+    """Proxy for a pyodbc connection, who's cursors count their statements."""
+    def __init__(self, conn, counts):
+        self.__dict__.update(_conn=conn, _counts=counts)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def cursor(self):
+        return _CountingCursor(self._conn.cursor(), self._counts)
+
+    def execute(self, stmt, *params):
+        return self.cursor().execute(stmt, *params)
+
+
+def run(loader, path, batch_size):
+    """Load the given payload with the given loader, printing the results as JSON."""
+    counts = dict(statements=0, executemany_rows=0)
+    connect = db._connect
+    db._connect = lambda: _CountingConnection(connect(), counts)
+
+    if loader == 'channels':
+        import fn_load_channels
+        load = fn_load_channels.load_channels
+    elif loader == 'users':
+        import fn_load_users
+        load = fn_load_users.load_users
+    else:
+        import fn_load_messages
+        load = fn_load_messages.load_messages
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        load(f, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(dict(loader=loader, seconds=round(elapsed, 2), peak_rss_mb=round(peak_mb, 1), **counts)))
+
+
+def _cleanup(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM st_channel_days WHERE channel_id LIKE 'CZZ%'")
+        cursor.execute("DELETE FROM st_user_activity WHERE user_id LIKE 'UZZ%'")
+        cursor.execute("DELETE FROM st_reactors WHERE user_id LIKE 'UZZ%'")
+        cursor.execute(f"DELETE FROM st_emojis WHERE emoji_id LIKE ':{payloads.PREFIX}-%'")
+        for table in ('sl_reactions', 'sl_files', 'sl_messages'):
+            cursor.execute(f"DELETE FROM {table} WHERE channel_id LIKE 'CZZ%'")
+        cursor.execute(f"DELETE FROM sl_emojis WHERE id LIKE ':{payloads.PREFIX}-%'")
+        cursor.execute("DELETE FROM sl_users WHERE id LIKE 'UZZ%'")
+        cursor.execute("DELETE FROM sl_channels WHERE id LIKE 'CZZ%'")
+        cursor.execute(f"DELETE FROM ingest_files WHERE name LIKE '%{payloads.PREFIX}-%'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=2500)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('INGEST_BATCH_SIZE', 1000)))
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'ubtsct-payloads'),
+                        help='where payloads are generated (and reused from)')
+    parser.add_argument('--keep', action='store_true', help="don't remove the loaded data afterwards")
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--loader', choices=_loaders, help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.loader:
+        run(args.loader, args.path, args.batch_size)
+        sys.exit(0)
+
+    generated = payloads.generate(args.dir, args.messages, args.users, args.channels)
+    with db.get_conn() as conn:
+        _cleanup(conn)
+
+    results = []
+    # In order, as messages reference channels and users
+    for loader in _loaders:
+        path, records = generated[loader]
+        proc = subprocess.run([sys.executable, __file__, '--loader', loader, '--path', path,
+                               '--batch-size', str(args.batch_size)], check=True, stdout=subprocess.PIPE, text=True)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result.update(records=records, records_per_sec=round(records / max(result['seconds'], 0.001)),
+                      mb=round(os.path.getsize(path) / 1024 / 1024, 1))
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    if not args.keep:
+        with db.get_conn() as conn:
+            _cleanup(conn)
+
+    report = dict(
+        created_at=datetime.datetime.utcnow().isoformat(timespec='seconds'),
+        batch_size=args.batch_size,
+        results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,148 @@
+"""
+Generate synthetic export files shaped exactly like the ones the loaders parse
+(see fn_load_channels, fn_load_users and fn_load_messages), e.g to size the
+Function plan before a backfill.
+
+Usage: python benchmarks/payloads.py [--dir /tmp/ubtsct-payloads] [--messages 100000] [--users 2500] [--channels 100]
+
+Messages start and reply to threads, and have files and reactions (with the
+users who reacted), followed by updates to some of them. The generator is
+seeded, so the same arguments always generate the same files. Ids are all
+prefixed (e.g CZZ00000001) so benchmark data can be told apart and removed.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+
+# File names, also used to find the benchmark's ledger entries (ingest_files)
+PREFIX = 'zz-bench'
+
+_words = ('the build is green again', 'anyone else stuck on', 'lesson', 'quiz', 'project', 'kubernetes',
+          'azure', 'docker', 'container', 'deadline', 'thanks', 'great job', 'help', 'error', 'deploy',
+          'pipeline', 'study jam', 'scholarship', 'phase 2', 'congrats', 'question', 'solved', 'link',
+          'café', 'naïve', '🎉', '👍')
+
+
+def channel_id(i):
+    return f'CZZ{i:08d}'
+
+
+def user_id(i):
+    return f'UZZ{i:08d}'
+
+
+def emoji_id(i):
+    return f':{PREFIX}-{i}:'
+
+
+def message_id(i):
+    return f'{1577836800 + i * 7}.{i % 1000000:06d}'
+
+
+def _write(path, inserts, updates=()):
+    """Write the given records as an {"inserts": [...], "updates": [...]} payload,
+    one record at a time, returns the number of records written.
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for section, records in (('inserts', inserts), ('updates', updates)):
+            f.write(('{' if section == 'inserts' else '], ') + json.dumps(section) + ': [')
+            for i, record in enumerate(records):
+                f.write((', ' if i else '') + json.dumps(record, ensure_ascii=False))
+                count += 1
+        f.write(']}')
+    return count
+
+
+def channels(rng, count):
+    for i in range(count):
+        yield dict(id=channel_id(i), name=f'{PREFIX}-{i}', description=f'Benchmark channel {i}')
+
+
+def users(rng, count):
+    for i in range(count):
+        yield dict(id=user_id(i), name=f'{PREFIX}-{i}', fullName=f'Bench User {i}', title=rng.choice(('', 'Scholar', 'Mentor')),
+                   avatarId=f'{rng.getrandbits(48):012x}', offset=f'UTC{rng.choice("+-")}{rng.randint(0, 12):02d}:00')
+
+
+def messages(rng, count, channels, users, emojis):
+    """Yield count messages. About 10% start a thread, 30% reply to one of
+    their channel's recent threads, 10% have files and 20% have reactions.
+    """
+    threads = {}
+    for i in range(count):
+        mid, ch = message_id(i), channel_id(rng.randrange(channels))
+        thread = None
+        roll = rng.random()
+        if roll < 0.1:
+            thread = mid
+            threads.setdefault(ch, []).append(mid)
+            del threads[ch][:-5]
+        elif roll < 0.4 and threads.get(ch):
+            thread = rng.choice(threads[ch])
+        msg = dict(id=mid, channel=ch, thread=thread, user=user_id(rng.randrange(users)),
+                   content=' '.join(rng.choice(_words) for _ in range(rng.randint(3, 30))),
+                   files=[f'https://files.slack.com/files-pri/T0000/F{i:08d}{n}/image.png'
+                          for n in range(rng.randint(1, 3))] if rng.random() < 0.1 else [],
+                   reactions={})
+        if rng.random() < 0.2:
+            for emoji in rng.sample(range(emojis), rng.randint(1, 3)):
+                msg['reactions'][emoji_id(emoji)] = dict(
+                    url=f'https://emoji.slack-edge.com/T0000/{PREFIX}-{emoji}.png',
+                    users=[user_id(u) for u in rng.sample(range(users), rng.randint(1, 5))])
+        yield msg
+
+
+def message_updates(seed, count, channels, users, emojis):
+    """Yield edits of about 5% of the messages generated from the given seed."""
+    rng = random.Random(f'{seed}-updates')
+    for msg in messages(random.Random(seed), count, channels, users, emojis):
+        if rng.random() < 0.05:
+            msg['content'] += ' (edited)'
+            yield msg
+
+
+def generate(directory, messages_count=100000, users_count=2500, channels_count=100, emojis_count=300, seed=0):
+    """Generate the channels, users and messages payloads into the given
+    directory (unless they're already there), returns a dict of
+    dataset: (path, record count).
+    """
+    os.makedirs(directory, exist_ok=True)
+    args = [messages_count, users_count, channels_count, emojis_count, seed]
+    meta_path = os.path.join(directory, f'{PREFIX}.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['args'] == args:
+            return {k: tuple(v) for k, v in meta['payloads'].items()}
+
+    rng = random.Random(seed)
+    paths = {name: os.path.join(directory, f'{PREFIX}-{name}.json') for name in ('channels', 'users', 'messages')}
+    result = dict(
+        channels=(paths['channels'], _write(paths['channels'], channels(rng, channels_count))),
+        users=(paths['users'], _write(paths['users'], users(rng, users_count))))
+    # Updates regenerate the inserted messages, so share a seed
+    msg_seed = rng.random()
+    result['messages'] = (paths['messages'], _write(
+        paths['messages'],
+        messages(random.Random(msg_seed), messages_count, channels_count, users_count, emojis_count),
+        message_updates(msg_seed, messages_count, channels_count, users_count, emojis_count)))
+    with open(meta_path, 'w') as f:
+        json.dump(dict(args=args, payloads=result), f)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'ubtsct-payloads'))
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=2500)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--emojis', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for name, (path, count) in generate(args.dir, args.messages, args.users, args.channels, args.emojis, args.seed).items():
+        print(f'{name}: {count} records, {os.path.getsize(path) / 1024 / 1024:.1f}MB at {path}')
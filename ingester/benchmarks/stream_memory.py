@@ -0,0 +1,81 @@
+"""
+Compare peak memory of decoding an ingest payload all at once (how the loaders
+used to, readlines + join + json.loads) against streaming it with support.stream.
+
+Usage: python benchmarks/stream_memory.py [--size-mb 500] [--path /tmp/messages.json]
+
+Each mode runs in it's own process, so peak RSS is measured independently.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def generate(path, size_mb):
+    """Write a synthetic messages payload of roughly size_mb to the given path."""
+    target = size_mb * 1024 * 1024
+    written = 0
+    i = 0
+    with open(path, 'w') as f:
+        f.write('{"inserts": [')
+        while written < target:
+            msg = dict(
+                id=f'{1600000000 + i}.{i % 1000000:06d}',
+                channel=f'C{i % 97:010d}',
+                thread=f'{1600000000 + i - i % 20}.{(i - i % 20) % 1000000:06d}',
+                user=f'U{i % 2441:010d}',
+                content='Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * (1 + i % 8),
+                files=[f'https://files.slack.com/files-pri/T0000/F{i:08d}/screenshot.png'] if i % 10 == 0 else [],
+                reactions={':+1:': dict(url='https://a.slack-edge.com/+1.png', users=[f'U{i % 31:010d}'])} if i % 4 == 0 else {}
+            )
+            line = (',' if i else '') + json.dumps(msg)
+            f.write(line)
+            written += len(line)
+            i += 1
+        f.write('], "updates": []}')
+    return i
+
+
+def run(mode, path):
+    from support import stream
+    start = time.perf_counter()
+    count = 0
+    if mode == 'loads':
+        with open(path, 'rb') as f:
+            data = json.loads(b''.join(f.readlines()))
+        for section in ('inserts', 'updates'):
+            for _ in data[section]:
+                count += 1
+    else:
+        with open(path, 'rb') as f:
+            for _, items in stream.iter_batches(f, batch_size=100):
+                count += len(items)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(dict(mode=mode, items=count, seconds=round(elapsed, 2), peak_rss_mb=round(peak_mb, 1))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=500)
+    parser.add_argument('--path', help='payload to use (generated when missing)')
+    parser.add_argument('--mode', choices=['loads', 'stream'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.path)
+        sys.exit(0)
+
+    path = args.path or os.path.join(tempfile.gettempdir(), f'ubtsct-messages-{args.size_mb}mb.json')
+    if not os.path.exists(path):
+        print(f'Generating {args.size_mb}MB payload at {path}')
+        generate(path, args.size_mb)
+    for mode in ('loads', 'stream'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--path', path], check=True)
@@ -1,12 +1,17 @@
+import os
 import logging
-import json
 import azure.functions as func
 
-from support import db
+from support import cache, db, ledger, stream
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)-8s]: %(message)s')
 
-def load_channels(datastr):
+def load_channels(data, batch_size=None, name=None):
+    """Load the channels from the given payload, a JSON str/bytes or file-like
+    object, decoding and writing a batch of channels at a time (INGEST_BATCH_SIZE).
+    Each batch is committed with the file's ledger entry, so a loaded file is
+    skipped.
+    """
     insert_channel_stmt = """
         INSERT INTO sl_channels (id, name, description, archived_at)
           (SELECT ?, ?, ?, getdate()
@@ -20,29 +25,40 @@ def load_channels(datastr):
          WHERE id = ?
     """
 
+    batch_size = batch_size or int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+    name = name or getattr(data, 'name', None)
+    digest, data = ledger.content_hash(data)
     with db.get_conn() as conn:
-        data = json.loads(datastr)
+        entry = ledger.Entry(conn, 'channels', name, digest)
+        skip = entry.begin()
+        if skip is None:
+            return
         with conn.cursor() as cursor:
-            for channel in data['inserts']:
-            #logging.info(f'Inserting channel: {channel}')
-                cursor.execute(insert_channel_stmt, 
-                    channel['id'],
-                    channel['name'],
-                    channel['description'],
-                    channel['id']
-                )
-
-            for channel in data['updates']:
-                cursor.execute(update_channel_stmt,
-                    channel['name'],
-                    channel['description'],
-                    channel['id']
-                )
+            for section, channels in stream.iter_batches(data, batch_size=batch_size, skip=skip):
+                if section == 'inserts':
+                    cursor.executemany(insert_channel_stmt, [(
+                        channel['id'],
+                        channel['name'],
+                        channel['description'],
+                        channel['id']
+                    ) for channel in channels])
+                else:
+                    cursor.executemany(update_channel_stmt, [(
+                        channel['name'],
+                        channel['description'],
+                        channel['id']
+                    ) for channel in channels])
+                entry.checkpoint(len(channels))
+        entry.complete()
+
+        cache.invalidate(conn, 'channels')
+
 
 def main(event: func.EventGridEvent, data):
     try:
         logging.info(f'loading data file {data.name}')
-        load_channels(b''.join(data.readlines()))
+        load_channels(data)
     except Exception as e:
         logging.error(f'Unable to load channels. {e}')
+        raise
 
@@ -1,62 +1,151 @@
+import os
 import logging
-import json
 import azure.functions as func
 
-from support import db
+from support import bulk, cache, db, ledger, stream
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)-8s]: %(message)s')
 
 
-insert_emoji_stmt = """
-    INSERT INTO sl_emojis (id, url)
-        (SELECT ?, ? WHERE NOT EXISTS (
-            SELECT 1 FROM sl_emojis
-            WHERE sl_emojis.id = ?
-                AND sl_emojis.url = ?
-        ))
+# Messages are decoded in batches, each batch is fast loaded into these staging 
+# tables, then applied to their target tables with one MERGE per table.
+stg_messages = bulk.StagingTable('#stg_messages', [
+    ('id', 'varchar(17)'),
+    ('channel_id', 'varchar(11)'),
+    ('thread_id', 'varchar(17)'),
+    ('user_id', 'varchar(11)'),
+    ('content', 'nvarchar(max)')
+])
+
+stg_files = bulk.StagingTable('#stg_files', [
+    ('message_id', 'varchar(17)'),
+    ('channel_id', 'varchar(11)'),
+    ('url', 'varchar(2048)')
+])
+
+stg_emojis = bulk.StagingTable('#stg_emojis', [
+    ('id', 'varchar(255)'),
+    ('url', 'varchar(2048)')
+])
+
+stg_reactions = bulk.StagingTable('#stg_reactions', [
+    ('message_id', 'varchar(17)'),
+    ('channel_id', 'varchar(11)'),
+    ('user_id', 'varchar(11)'),
+    ('emoji_id', 'varchar(255)')
+])
+
+# Note: sources are de-duplicated as a batch may repeat rows, and HOLDLOCK
+# keeps concurrent loads from inserting the same row between match and insert
+merge_emojis_stmt = """
+    MERGE sl_emojis WITH (HOLDLOCK) AS t
+    USING (SELECT id, MAX(url) AS url FROM #stg_emojis GROUP BY id) AS s
+       ON t.id = s.id
+    WHEN NOT MATCHED THEN
+        INSERT (id, url) VALUES (s.id, s.url);
 """
 
-insert_files_stmt = """
-    INSERT INTO sl_files (message_id, channel_id, url)
-        (SELECT ?,?,? WHERE NOT EXISTS (
-            SELECT 1 FROM sl_files
-            WHERE sl_files.message_id = ?
-                AND sl_files.channel_id = ?
-                AND url = ?
-        ))
+merge_files_stmt = """
+    MERGE sl_files WITH (HOLDLOCK) AS t
+    USING (SELECT DISTINCT message_id, channel_id, url FROM #stg_files) AS s
+       ON t.message_id = s.message_id AND t.channel_id = s.channel_id AND t.url = s.url
+    WHEN NOT MATCHED THEN
+        INSERT (message_id, channel_id, url) VALUES (s.message_id, s.channel_id, s.url);
 """
 
-insert_reaction_stmt = """
-    INSERT INTO sl_reactions (message_id, channel_id, user_id, emoji_id)
-        (SELECT ?,?,?, ? WHERE NOT EXISTS (
-            SELECT 1 FROM sl_reactions
-            WHERE sl_reactions.message_id = ?
-                AND sl_reactions.channel_id = ?
-                AND sl_reactions.user_id = ?
-                AND sl_reactions.emoji_id = ?
-        ))
+merge_reactions_stmt = """
+    MERGE sl_reactions WITH (HOLDLOCK) AS t
+    USING (SELECT DISTINCT message_id, channel_id, user_id, emoji_id FROM #stg_reactions) AS s
+       ON t.message_id = s.message_id AND t.channel_id = s.channel_id 
+          AND t.user_id = s.user_id AND t.emoji_id = s.emoji_id
+    WHEN NOT MATCHED THEN
+        INSERT (message_id, channel_id, user_id, emoji_id) 
+        VALUES (s.message_id, s.channel_id, s.user_id, s.emoji_id);
 """
 
-insert_msg_stmt = """
-    INSERT INTO sl_messages (id, channel_id, thread_id, user_id, content)
-        (SELECT ?, ?, ?, ?, ? 
-        WHERE NOT EXISTS (
-            SELECT 1 FROM sl_messages 
-            WHERE sl_messages.id = ? AND sl_messages.channel_id = ?))
+_staged_messages = """
+    (SELECT * FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY id, channel_id ORDER BY (SELECT NULL)) AS n
+          FROM #stg_messages) AS m
+     WHERE n = 1)
 """
 
-update_msg_stmt = """
-    UPDATE sl_messages SET
-        content = ?
-     WHERE id = ?
+insert_msg_stmt = f"""
+    MERGE sl_messages WITH (HOLDLOCK) AS t
+    USING {_staged_messages} AS s
+       ON t.id = s.id AND t.channel_id = s.channel_id
+    WHEN NOT MATCHED THEN
+        INSERT (id, channel_id, thread_id, user_id, content)
+        VALUES (s.id, s.channel_id, s.thread_id, s.user_id, s.content);
 """
 
+update_msg_stmt = f"""
+    MERGE sl_messages AS t
+    USING {_staged_messages} AS s
+       ON t.id = s.id AND t.channel_id = s.channel_id
+    WHEN MATCHED THEN
+        UPDATE SET content = s.content;
+"""
+
+# The stats are recounted from the tables they summarize (rather than
+# incremented), so replaying a batch, e.g when a failed load resumes, never
+# counts it's rows twice. Each batch recounts the days of it's channels, which
+# only the loader of the channel's messages writes (see manage.py partitions).
+_message_day = "CAST(DATEADD(second, CAST(LEFT(id, CHARINDEX('.', id + '.') - 1) AS int), '19700101') AS date)"
+
+update_stats_stmt = f"""
+    MERGE st_channel_days WITH (HOLDLOCK) AS t
+    USING (
+        SELECT d.channel_id, d.day, COUNT(*) AS messages
+          FROM (SELECT DISTINCT channel_id, {_message_day} AS day FROM #stg_messages) AS d
+          JOIN sl_messages AS m ON m.channel_id = d.channel_id
+               -- Ids start with a (10 digit) unix timestamp, so a day is a range of ids
+               AND m.id >= CAST(DATEDIFF(second, '19700101', d.day) AS varchar(10))
+               AND m.id < CAST(DATEDIFF(second, '19700101', DATEADD(day, 1, d.day)) AS varchar(10))
+         GROUP BY d.channel_id, d.day) AS s
+       ON t.channel_id = s.channel_id AND t.day = s.day
+    WHEN MATCHED THEN
+        UPDATE SET messages = s.messages
+    WHEN NOT MATCHED THEN
+        INSERT (channel_id, day, messages) VALUES (s.channel_id, s.day, s.messages);
+"""
+
+# Users and emojis appear in many channels, so they're recounted (all of them)
+# once a load is done, see refresh_stats. Recounting them in every batch would
+# have parallel loads locking each other's stats rows.
+refresh_stats_stmt = """
+    MERGE st_user_activity WITH (HOLDLOCK) AS t
+    USING (SELECT user_id, COUNT(*) AS messages, MAX(id) AS last_message_id
+             FROM sl_messages
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id) AS s
+       ON t.user_id = s.user_id
+    WHEN MATCHED AND (t.messages <> s.messages OR t.last_message_id <> s.last_message_id) THEN
+        UPDATE SET messages = s.messages, last_message_id = s.last_message_id
+    WHEN NOT MATCHED THEN
+        INSERT (user_id, messages, last_message_id) VALUES (s.user_id, s.messages, s.last_message_id);
+
+    MERGE st_reactors WITH (HOLDLOCK) AS t
+    USING (SELECT user_id, COUNT(*) AS reactions FROM sl_reactions GROUP BY user_id) AS s
+       ON t.user_id = s.user_id
+    WHEN MATCHED AND t.reactions <> s.reactions THEN
+        UPDATE SET reactions = s.reactions
+    WHEN NOT MATCHED THEN
+        INSERT (user_id, reactions) VALUES (s.user_id, s.reactions);
+
+    MERGE st_emojis WITH (HOLDLOCK) AS t
+    USING (SELECT emoji_id, COUNT(*) AS reactions FROM sl_reactions GROUP BY emoji_id) AS s
+       ON t.emoji_id = s.emoji_id
+    WHEN MATCHED AND t.reactions <> s.reactions THEN
+        UPDATE SET reactions = s.reactions
+    WHEN NOT MATCHED THEN
+        INSERT (emoji_id, reactions) VALUES (s.emoji_id, s.reactions);
+"""
+
+
 def _set_file_data(msg, file_data):
     for furl in msg.get('files', []):
         file_data.append((
-            msg['id'], 
-            msg['channel'], 
-            furl, 
             msg['id'], 
             msg['channel'], 
             furl
@@ -66,18 +155,12 @@ def _set_file_data(msg, file_data):
 def _set_react_data(msg, emoji_data, user_data):
     for emoji_id, emoji in msg.get('reactions', {}).items():
         emoji_data.append((
-            emoji_id, 
-            emoji['url'], 
             emoji_id, 
             emoji['url']
         ))
 
         for user in emoji.get('users',[]):
             user_data.append((
-                msg['id'], 
-                msg['channel'], 
-                user, 
-                emoji_id, 
                 msg['id'], 
                 msg['channel'], 
                 user, 
@@ -86,78 +169,99 @@ def _set_react_data(msg, emoji_data, user_data):
     return emoji_data, user_data
 
 
-def load_messages(datastr):
+def _write_batch(cursor, msg_stmt, msg_data, file_data, react_emoji_data, react_user_data):
+    """Write a batch, and it's channels' day stats, with the given cursor. 
+    Nothing is committed, so the batch commits (or rolls back) with it's checkpoint.
+    """
+    stg_messages.load(cursor, msg_data)
+    cursor.execute(msg_stmt)
+    if file_data:
+        stg_files.load(cursor, file_data)
+        cursor.execute(merge_files_stmt)
+    if react_emoji_data:
+        stg_emojis.load(cursor, react_emoji_data)
+        cursor.execute(merge_emojis_stmt)
+    if react_user_data:
+        stg_reactions.load(cursor, react_user_data)
+        cursor.execute(merge_reactions_stmt)
+    cursor.execute(update_stats_stmt)
+
+
+def refresh_stats(conn, attempts=3):
+    """Recount the user and emoji stats, in their own transaction. Retried
+    when chosen as a deadlock victim, e.g by another load's refresh.
+    """
+    for attempt in range(1, attempts + 1):
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(refresh_stats_stmt)
+            conn.commit()
+            return
+        except Exception as e:
+            conn.rollback()
+            if not db.is_deadlock(e) or attempt == attempts:
+                raise
+            logging.warning(f'Deadlocked refreshing stats, retrying ({attempt}/{attempts})')
+        finally:
+            conn.autocommit = True
+
+
+def load_messages(data, batch_size=None, name=None, refresh=True):
+    """Load the messages (with their files and reactions) from the given payload,
+    a JSON str/bytes or file-like object. Messages are decoded and written 
+    a batch at a time (INGEST_BATCH_SIZE), so the whole payload is never 
+    held in memory. Each batch is committed with the file's ledger entry, so
+    a failed load resumes where it left off and a loaded file is skipped.
+
+    :param refresh: whether to refresh the user and emoji stats afterwards 
+        (see refresh_stats), e.g not until all of a parallel import has loaded
+    """
+    batch_size = batch_size or int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+    name = name or getattr(data, 'name', None)
+    digest, data = ledger.content_hash(data)
+    staging_tables = (stg_messages, stg_files, stg_emojis, stg_reactions)
     with db.get_conn() as conn:
-        data = json.loads(datastr)
+        entry = ledger.Entry(conn, 'messages', name, digest)
+        skip = entry.begin()
+        if skip is None:
+            return
         with conn.cursor() as cursor:
-            cursor.fast_executemany = True
-            msg_data = []
-            file_data = []
-            react_emoji_data = []
-            react_user_data = []
-            i = len(data['inserts'])
-            for msg in data['inserts']:
-                #logging.info(f'Inserting channel: {channel}')
-                logging.info(f"insert msg: {msg['id']}, {msg['channel']}")
-                msg_data.append((
-                    msg['id'], 
-                    msg['channel'], 
-                    msg['thread'], 
-                    msg['user'], 
-                    msg['content'], 
-                    msg['id'], 
-                    msg['channel']                    
-                ))
-                _set_file_data(msg, file_data)
-                _set_react_data(msg, react_emoji_data, react_user_data)
-
-                if len(msg_data) == 100 or i == 1:                
-                    cursor.executemany(insert_msg_stmt, msg_data)
-                    if file_data:
-                        cursor.executemany(insert_files_stmt, file_data)
-                    if react_emoji_data:
-                        cursor.executemany(insert_emoji_stmt, react_emoji_data)
-                    if react_user_data:
-                        cursor.executemany(insert_reaction_stmt, react_user_data)
-                    msg_data = []
-                    file_data = []
-                    react_emoji_data = []
-                    react_user_data = []
-                i -= 1
-                
-            msg_data = []
-            file_data = []
-            react_emoji_data = []
-            react_user_data = []
-            i = len(data['updates'])
-            for msg in data['updates']: 
-                logging.info(f"update msg: {msg['id']}, {msg['channel']}")
-                msg_data.append((
-                    msg['content'], 
-                    msg['id']
-                ))
-                _set_file_data(msg, file_data)
-                _set_react_data(msg, react_emoji_data, react_user_data)
-                if len(msg_data) == 100 or i == 1:          
-                    cursor.executemany(update_msg_stmt, msg_data)
-                    if file_data:
-                        cursor.executemany(insert_files_stmt, file_data)
-                    if react_emoji_data:
-                        cursor.executemany(insert_emoji_stmt, react_emoji_data)
-                    if react_user_data:
-                        cursor.executemany(insert_reaction_stmt, react_user_data)
-                    msg_data = []
-                    file_data = []
-                    react_emoji_data = []
-                    react_user_data = []
-                i -= 1
+            for table in staging_tables:
+                table.create(cursor)
+            for section, msgs in stream.iter_batches(data, batch_size=batch_size, skip=skip):
+                msg_data = []
+                file_data = []
+                react_emoji_data = []
+                react_user_data = []
+                for msg in msgs:
+                    msg_data.append((
+                        msg['id'], 
+                        msg['channel'], 
+                        msg['thread'], 
+                        msg['user'], 
+                        msg['content']
+                    ))
+                    _set_file_data(msg, file_data)
+                    _set_react_data(msg, react_emoji_data, react_user_data)
+                logging.info(f'{section} {len(msg_data)} msgs, {msgs[0]["id"]} to {msgs[-1]["id"]}')
+                msg_stmt = insert_msg_stmt if section == 'inserts' else update_msg_stmt
+                _write_batch(cursor, msg_stmt, msg_data, file_data, react_emoji_data, react_user_data)
+                entry.checkpoint(len(msgs))
+            for table in staging_tables:
+                table.drop(cursor)
+        entry.complete()
+        if refresh:
+            refresh_stats(conn)
 
+        cache.invalidate(conn, 'messages')
 
 
 def main(event: func.EventGridEvent, data):
     try:
         logging.info(f'loading data file {data.name}')
-        load_messages(b''.join(data.readlines()))
+        load_messages(data)
     except Exception as e:
-        logging.error(f'Unable to load channels. {e}')
-
+        logging.error(f'Unable to load messages. {e}')
+        # Let Event Grid redeliver, the ledger resumes after the last committed batch
+        raise
@@ -1,12 +1,17 @@
+import os
 import logging
-import json
 import azure.functions as func
 
-from support import db
+from support import cache, db, ledger, stream
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)-8s]: %(message)s')
 
-def load_users(datastr):
+def load_users(data, batch_size=None, name=None):
+    """Load the users from the given payload, a JSON str/bytes or file-like
+    object, decoding and writing a batch of users at a time (INGEST_BATCH_SIZE).
+    Each batch is committed with the file's ledger entry, so a loaded file is
+    skipped.
+    """
     insert_user_stmt = """
         INSERT INTO sl_users (id, name, full_name, description, avatar_id, tz_offset, archived_at)
             (SELECT ?, ?, ?, ?, ?, ?, getdate()
@@ -22,41 +27,49 @@ def load_users(datastr):
          WHERE id = ?
     """
     
+    batch_size = batch_size or int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+    name = name or getattr(data, 'name', None)
+    digest, data = ledger.content_hash(data)
     with db.get_conn() as conn:
-        data = json.loads(datastr)
+        entry = ledger.Entry(conn, 'users', name, digest)
+        skip = entry.begin()
+        if skip is None:
+            return
         with conn.cursor() as cursor:
             cursor.fast_executemany = True
-            user_data = []
-            for user in data['inserts']:
-                #logging.info(f'Inserting user: {user}')
-                user_data.append((
-                    user['id'],
-                    user['name'],
-                    user['fullName'],
-                    user['title'],
-                    user['avatarId'],
-                    user['offset'],
-                    user['id']                    
-                ))
-            if user_data:
-                cursor.executemany(insert_user_stmt, user_data)
+            for section, users in stream.iter_batches(data, batch_size=batch_size, skip=skip):
+                user_data = []
+                for user in users:
+                    if section == 'inserts':
+                        #logging.info(f'Inserting user: {user}')
+                        user_data.append((
+                            user['id'],
+                            user['name'],
+                            user['fullName'],
+                            user['title'],
+                            user['avatarId'],
+                            user['offset'],
+                            user['id']                    
+                        ))
+                    else:
+                        user_data.append((
+                            user['name'],
+                            user['fullName'],
+                            user['title'],
+                            user['offset'],
+                            user['id']                    
+                        ))
+                cursor.executemany(insert_user_stmt if section == 'inserts' else update_user_stmt, user_data)
+                entry.checkpoint(len(users))
+        entry.complete()
 
-            user_data = []
-            for user in data['updates']:
-                user_data.append((
-                    user['name'],
-                    user['fullName'],
-                    user['title'],
-                    user['offset'],
-                    user['id']                    
-                ))
-            if user_data:
-                cursor.executemany(update_user_stmt, user_data)
+        cache.invalidate(conn, 'users')
                 
 
 def main(event: func.EventGridEvent, data):
     try:
         logging.info(f'loading data file {data.name}')
-        load_users(b''.join(data.readlines()))
+        load_users(data)
     except Exception as e:
-        logging.error(f'Unable to load users. {e}')
\ No newline at end of file
+        logging.error(f'Unable to load users. {e}')
+        raise
\ No newline at end of file
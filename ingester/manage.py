@@ -1,26 +1,154 @@
+"""
+Import the exported data files waiting in <source>/{channels,users,messages},
+moving each to <source>/archive once it's loaded.
+
+Usage: python manage.py [--source ../production] [--workers 4] [--pool process]
+
+Channels are loaded before users, and users before messages, as messages
+reference both. With more than one worker, the messages are partitioned by
+channel and the partitions loaded in parallel, so no two workers write the
+same rows. Each channel always lands in the same partition, keeping the
+order of it's inserts and updates across files.
+"""
+import argparse
+import json
+import logging
 import os
+import shutil
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import fn_load_messages
 import fn_load_users, fn_load_channels
+from support import cache, db, stream
 
 
 def import_data(source, archive, fn):
-    for fname in os.listdir(source):
+    for fname in sorted(os.listdir(source)):
         fpath = f'{source}/{fname}'
-        with open(fpath) as file:
-            fn(''.join(file.readlines()))
+        with open(fpath, 'rb') as file:
+            fn(file)
             os.rename(fpath, f'{archive}/{fname}')
 
-import_data(
-    source='../production/channels', 
-    archive='../production/archive/channels', 
-    fn=fn_load_channels.load_channels)
 
-import_data(
-    source='../production/users', 
-    archive='../production/archive/users', 
-    fn=fn_load_users.load_users)
+class _PartitionWriter:
+    """Writes the records of one source file belonging to a partition as an
+    ingest payload of it's own, e.g {"inserts": [...], "updates": [...]}.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.section = None
+        self.count = 0
+
+    def write(self, section, item):
+        if section != self.section:
+            self.file.write(('], ' if self.section else '{') + json.dumps(section) + ': [')
+            self.section = section
+        else:
+            self.file.write(', ')
+        self.file.write(json.dumps(item))
+        self.count += 1
+
+    def close(self):
+        self.file.write(']}' if self.section else '{}')
+        self.file.close()
+
+
+def partition_messages(paths, parts, workdir):
+    """Split the given message files into parts partitions by channel, returns
+    a list (one per partition) of [(path, record count)] payloads to load in order.
+    """
+    partitions = [[] for _ in range(parts)]
+    for fpath in paths:
+        writers = {}
+        with open(fpath, 'rb') as file:
+            for section, msg in stream.iter_records(file):
+                # crc32 rather than hash(), which is salted per process
+                part = zlib.crc32(msg['channel'].encode()) % parts
+                if part not in writers:
+                    writers[part] = _PartitionWriter(os.path.join(workdir, f'{part}-{os.path.basename(fpath)}'))
+                writers[part].write(section, msg)
+        for part, writer in sorted(writers.items()):
+            writer.close()
+            partitions[part].append((writer.file.name, writer.count))
+    return partitions
+
+
+def load_partition(worker, payloads):
+    """Load a partition's payloads in order, logging progress as we go, returns
+    a (worker, record count, seconds) tuple.
+    """
+    total = 0
+    start = time.perf_counter()
+    for i, (path, count) in enumerate(payloads, 1):
+        with open(path, 'rb') as file:
+            fn_load_messages.load_messages(file, refresh=False)
+        total += count
+        elapsed = time.perf_counter() - start
+        logging.info(f'worker {worker}: {i}/{len(payloads)} files, {total} msgs, {total / max(elapsed, 0.001):.0f} msgs/s')
+    return worker, total, time.perf_counter() - start
+
+
+def import_messages(source, archive, workers, pool):
+    """Load the message files in parallel, partitioned by channel."""
+    fnames = sorted(os.listdir(source))
+    if not fnames:
+        return
+    workdir = tempfile.mkdtemp(prefix='ubtsct-partitions-')
+    try:
+        partitions = partition_messages([f'{source}/{fname}' for fname in fnames], workers, workdir)
+        executor = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        start = time.perf_counter()
+        total = 0
+        with executor(max_workers=workers) as ex:
+            futures = [ex.submit(load_partition, worker, payloads)
+                       for worker, payloads in enumerate(partitions) if payloads]
+            for future in as_completed(futures):
+                worker, count, seconds = future.result()
+                total += count
+                print(f'worker {worker} done: {count} msgs in {seconds:.1f}s ({count / max(seconds, 0.001):.0f} msgs/s)')
+        elapsed = time.perf_counter() - start
+        print(f'loaded {total} msgs from {len(fnames)} files in {elapsed:.1f}s ({total / max(elapsed, 0.001):.0f} msgs/s)')
+        # Once, rather than by every worker, as users and emojis span partitions
+        with db.get_conn() as conn:
+            fn_load_messages.refresh_stats(conn)
+            cache.invalidate(conn, 'messages')
+    finally:
+        shutil.rmtree(workdir)
+
+    # Only archived once every partition has loaded, so a failed import can just be rerun
+    for fname in fnames:
+        os.rename(f'{source}/{fname}', f'{archive}/{fname}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='../production')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('INGEST_WORKERS', 1)),
+                        help='number of message partitions to load in parallel (default: 1, serial)')
+    parser.add_argument('--pool', choices=['process', 'thread'], default='process')
+    args = parser.parse_args()
+
+    import_data(
+        source=f'{args.source}/channels',
+        archive=f'{args.source}/archive/channels',
+        fn=fn_load_channels.load_channels)
+
+    import_data(
+        source=f'{args.source}/users',
+        archive=f'{args.source}/archive/users',
+        fn=fn_load_users.load_users)
 
-import_data(
-    source='../production/messages', 
-    archive='../production/archive/messages', 
-    fn=fn_load_messages.load_messages)
\ No newline at end of file
+    if args.workers > 1:
+        import_messages(
+            source=f'{args.source}/messages',
+            archive=f'{args.source}/archive/messages',
+            workers=args.workers,
+            pool=args.pool)
+    else:
+        import_data(
+            source=f'{args.source}/messages',
+            archive=f'{args.source}/archive/messages',
+            fn=fn_load_messages.load_messages)
@@ -0,0 +1,45 @@
+import pyodbc
+
+
+class StagingTable:
+    """A session scoped temp table (e.g, #stg_messages) that batches of rows are
+    fast loaded into, so they can be applied to their target table with a
+    single set based statement (e.g, MERGE) rather than row by row.
+
+    :param name: name of the temp table, must start with #
+    :param columns: list of (name, sql type) tuples
+    """
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+        self.insert_stmt = f"""
+            INSERT INTO {name} ({', '.join(c for c, _ in columns)})
+                VALUES ({', '.join('?' * len(columns))})
+        """
+        # Tell pyodbc how big (max) columns can be, otherwise fast_executemany
+        # sizes its buffers from the first row and truncates bigger values
+        self.input_sizes = [
+            (pyodbc.SQL_WVARCHAR, 0, 0) if sql_type.endswith('(max)') else None
+            for _, sql_type in columns
+        ]
+
+    def create(self, cursor):
+        cursor.execute(f"""
+            IF OBJECT_ID('tempdb..{self.name}') IS NOT NULL DROP TABLE {self.name};
+            CREATE TABLE {self.name} ({', '.join(f'{c} {t}' for c, t in self.columns)});
+        """)
+
+    def truncate(self, cursor):
+        cursor.execute(f'TRUNCATE TABLE {self.name}')
+
+    def load(self, cursor, rows):
+        """Replace the staged rows with the given rows."""
+        self.truncate(cursor)
+        if rows:
+            cursor.fast_executemany = True
+            # Always set, so sizes from another staging table aren't applied to ours
+            cursor.setinputsizes(self.input_sizes)
+            cursor.executemany(self.insert_stmt, rows)
+
+    def drop(self, cursor):
+        cursor.execute(f"IF OBJECT_ID('tempdb..{self.name}') IS NOT NULL DROP TABLE {self.name}")
@@ -0,0 +1,46 @@
+import os
+import logging
+import dotenv
+
+from support import db
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '../../.env')
+dotenv.load_dotenv(dotenv_path)
+
+_client = None
+
+
+def get_client():
+    """Return a client for the API's shared (redis) cache, or None if the API
+    isn't configured to use one (see CACHE_TYPE).
+    """
+    global _client
+    if _client is None and redis and os.environ.get('CACHE_TYPE') == 'redis':
+        _client = redis.Redis.from_url(os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    return _client
+
+
+def invalidate(conn, *names):
+    """Invalidate everything the API has cached for the given data sets, call
+    after new data has been committed. The API keys it's cache on each data
+    set's version, so bumping the version moves it on to a new namespace. We
+    also drop the API's cached copy of the version so it doesn't have to wait
+    for it to expire.
+
+    :param conn: the db connection to use
+    :param names: the data sets that were loaded (channels, users or messages)
+    """
+    db.bump_data_version(conn, *names)
+    client = get_client()
+    if client:
+        prefix = os.environ.get('CACHE_KEY_PREFIX', 'ubtsapi/')
+        try:
+            client.delete(*[f'{prefix}data_version/{name}' for name in names])
+        except redis.RedisError as e:
+            # The API will still pick up the new version once it's copy expires
+            logging.warning(f'Unable to invalidate cached data versions {names}. {e}')
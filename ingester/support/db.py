@@ -1,4 +1,8 @@
 import os
+import time
+import logging
+import threading
+import collections
 import pyodbc
 import dotenv
 
@@ -6,7 +10,17 @@ dotenv_path = os.path.join(os.path.dirname(__file__), '../../.env')
 dotenv.load_dotenv(dotenv_path)
 
 
-def get_conn():
+# Must be set before the first connection is made. Leave the driver manager's
+# pooling on unless it misbehaves, it's what our pool falls back on.
+pyodbc.pooling = os.environ.get('DB_ODBC_POOLING', 'true').lower() == 'true'
+
+# SQLSTATEs meaning the connection itself is gone, rather than the statement failed
+_disconnect_states = ('08S01', '08001', '08003', '08007', 'HYT00', 'HYT01')
+# SQLSTATE of a transaction chosen as a deadlock victim, which can just be retried
+_deadlock_state = '40001'
+
+
+def _connect():
     driver = '{ODBC Driver 17 for SQL Server}'
     server_host = os.environ.get('DB_SERVER_HOST')
     server_port = 1433
@@ -14,12 +28,171 @@ def get_conn():
     db_user = os.environ.get('DB_USERNAME')
     db_password = os.environ.get('DB_PASSWORD')
     return pyodbc.connect(f'DRIVER={driver};SERVER={server_host};PORT={server_port};DATABASE={db_name};UID={db_user};PWD={db_password}', autocommit=True)
-    
+
+
+class PooledConnection:
+    """A pyodbc connection checked out of the pool, returned to it (rather than
+    closed) when the outermost `with` block exits or it's closed. Connections
+    that failed with a disconnect error are discarded instead.
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._cursor = None
+        self._depth = 0
+        self.last_used = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def autocommit(self):
+        return self._conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        # Must reach the pyodbc connection, e.g the ledger turns it off so each
+        # batch commits with it's checkpoint
+        self._conn.autocommit = value
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        discard = is_disconnect(exc)
+        try:
+            if exc is not None and not self._conn.autocommit:
+                try:
+                    self._conn.rollback()
+                except pyodbc.Error as e:
+                    # Keep the error we're exiting with, rather than the
+                    # rollback's (e.g the connection is gone), and don't reuse
+                    # a connection left part way through a transaction
+                    logging.warning(f'Rollback failed: {e}')
+                    discard = True
+            elif not self._conn.autocommit:
+                try:
+                    self._conn.commit()
+                except pyodbc.Error as e:
+                    discard = is_disconnect(e)
+                    raise
+        finally:
+            if self._depth == 0:
+                self._release(discard)
+
+    @property
+    def shared_cursor(self):
+        """A cursor that's kept for the life of the connection, for one off statements."""
+        if self._cursor is None:
+            self._cursor = self._conn.cursor()
+        return self._cursor
+
+    def ping(self):
+        try:
+            self.shared_cursor.execute('SELECT 1').fetchall()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def close(self):
+        self._release(False)
+
+    def _release(self, discard):
+        if self._conn is None:
+            return
+        if not discard and not self._conn.autocommit:
+            # Don't hand out a connection part way through someone else's transaction
+            try:
+                self._conn.rollback()
+                self._conn.autocommit = True
+            except pyodbc.Error as e:
+                logging.warning(f'Rollback failed, discarding the connection: {e}')
+                discard = True
+        self.last_used = time.monotonic()
+        self._pool.release(self, discard)
+
+    def _discard(self):
+        try:
+            self._conn.close()
+        except pyodbc.Error:
+            pass
+        self._conn = self._cursor = None
+
+
+class ConnectionPool:
+    """Keeps up to size idle connections around between (warm) function
+    invocations, so a burst of events doesn't pay the TLS and login handshake
+    for every file. Idle connections are checked with a SELECT 1 before being
+    handed out again, and replaced if they've gone away.
+
+    :param size: the max number of idle connections kept
+    :param ping_after: seconds a connection can be idle before it's checked
+    """
+    def __init__(self, size, ping_after):
+        self.size = size
+        self.ping_after = ping_after
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # Connections can't be shared with forked processes (e.g, manage.py workers)
+        if self._pid != os.getpid():
+            self._idle = collections.deque()
+            self._pid = os.getpid()
+
+    def get(self):
+        with self._lock:
+            self._check_pid()
+            while self._idle:
+                conn = self._idle.pop()
+                if time.monotonic() - conn.last_used < self.ping_after or conn.ping():
+                    return conn
+                logging.info('Discarding stale pooled db connection')
+                conn._discard()
+        return PooledConnection(self, _connect())
+
+    def release(self, conn, discard=False):
+        with self._lock:
+            self._check_pid()
+            if discard or len(self._idle) >= self.size:
+                conn._discard()
+            elif conn not in self._idle:
+                self._idle.append(conn)
+
+    def clear(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()._discard()
+
+
+def is_disconnect(exc):
+    return isinstance(exc, pyodbc.Error) and bool(exc.args) and exc.args[0] in _disconnect_states
+
+
+def is_deadlock(exc):
+    return isinstance(exc, pyodbc.Error) and bool(exc.args) and exc.args[0] == _deadlock_state
+
+
+_pool = ConnectionPool(
+    size=int(os.environ.get('DB_POOL_SIZE', 5)),
+    ping_after=int(os.environ.get('DB_POOL_PING_AFTER', 30))
+)
+
+
+def get_conn():
+    """Check a connection out of the module's pool, use it in a `with` block
+    (or close it) to return it.
+    """
+    return _pool.get()
+
 
 def execute_query(conn, stmt, fetchone=False, *params):
     results = None
     with conn:
-        cursor = conn.cursor()
+        cursor = conn.shared_cursor
         if params:
             cursor.execute(stmt, params)
         else:
@@ -35,6 +208,21 @@ def execute_stmt(conn, stmt, *params):
     :param stmt: the SQL statement to execute
     :param params: the bind parameters to our statement
     """
-    with conn.cursor() as cursor:
-        cursor.execute(stmt, params)
+    conn.shared_cursor.execute(stmt, params)
     return True
+
+
+def bump_data_version(conn, *names):
+    """Bump the version of the given data sets (e.g, messages), letting the
+    API know any totals or responses it has cached for them are stale.
+
+    :param conn: the db connection to use
+    :param names: the data sets that were loaded (channels, users or messages)
+    """
+    stmt = f"""
+        UPDATE data_versions SET
+            version = version + 1,
+            updated_at = getdate()
+         WHERE name IN ({','.join('?' * len(names))})
+    """
+    return execute_stmt(conn, stmt, *names)
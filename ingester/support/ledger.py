@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import tempfile
+
+_chunk_size = 1024 * 1024
+
+
+def content_hash(data):
+    """Return the sha256 of the given payload, along with the payload to load
+    from. Files that can't be rewound (e.g, a function's input stream) are
+    spooled to a temp file as they're hashed, rather than held in memory.
+
+    :param data: the payload as a str/bytes, or a text/binary file-like object
+    """
+    sha = hashlib.sha256()
+    if isinstance(data, (str, bytes, bytearray)):
+        sha.update(data.encode() if isinstance(data, str) else data)
+        return sha.hexdigest(), data
+
+    seekable = data.seekable() if hasattr(data, 'seekable') else False
+    copy = None if seekable else tempfile.SpooledTemporaryFile(max_size=16 * _chunk_size)
+    start = data.tell() if seekable else 0
+    while True:
+        chunk = data.read(_chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        sha.update(chunk)
+        if copy:
+            copy.write(chunk)
+    if copy:
+        copy.seek(0)
+        return sha.hexdigest(), copy
+    data.seek(start)
+    return sha.hexdigest(), data
+
+
+class Entry:
+    """A file's entry in the ingest ledger (ingest_files).
+
+    Between `begin` and `complete` the connection is taken out of autocommit,
+    so each batch of records is committed along with the ledger's count of
+    them by `checkpoint`. Should the load fail, the next attempt picks up
+    after the last checkpoint, and once complete the file is skipped.
+
+    :param conn: the db connection the file is being loaded with
+    :param dataset: the data set being loaded (channels, users or messages)
+    :param name: the file's name, for reference
+    :param content_hash: the sha256 of the file's contents (see `content_hash`)
+    """
+    def __init__(self, conn, dataset, name, content_hash):
+        self.conn = conn
+        self.dataset = dataset
+        self.name = (name or '')[:255]
+        self.content_hash = content_hash
+        self.records = 0
+        self.completed = False
+
+    def begin(self):
+        """Record the file as started (if it's new), returns the number of
+        records already committed, or None if the file has already been loaded.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                MERGE ingest_files WITH (HOLDLOCK) AS t
+                USING (SELECT ? AS content_hash) AS s
+                   ON t.content_hash = s.content_hash
+                WHEN NOT MATCHED THEN
+                    INSERT (content_hash, dataset, name, records, started_at, updated_at)
+                    VALUES (s.content_hash, ?, ?, 0, getdate(), getdate());
+            """, self.content_hash, self.dataset, self.name)
+            row = cursor.execute(
+                'SELECT records, completed_at FROM ingest_files WHERE content_hash = ?',
+                self.content_hash).fetchone()
+        self.records, self.completed = row[0], row[1] is not None
+        if self.completed:
+            logging.info(f'{self.name} ({self.content_hash}) already loaded, skipping')
+            return None
+        if self.records:
+            logging.info(f'{self.name} ({self.content_hash}) resuming after {self.records} records')
+        self.conn.autocommit = False
+        return self.records
+
+    def checkpoint(self, count):
+        """Commit the batch just written, along with the count of it's records."""
+        self.records += count
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_files SET
+                    records = ?,
+                    updated_at = getdate()
+                 WHERE content_hash = ?
+            """, self.records, self.content_hash)
+        self.conn.commit()
+
+    def complete(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_files SET
+                    completed_at = getdate(),
+                    updated_at = getdate()
+                 WHERE content_hash = ?
+            """, self.content_hash)
+        self.conn.commit()
+        self.conn.autocommit = True
+        self.completed = True
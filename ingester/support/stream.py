@@ -0,0 +1,129 @@
+import io
+import json
+import codecs
+import itertools
+
+_whitespace = ' \t\n\r'
+_value_ends = ',:]}' + _whitespace
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Buffered reader over a text or binary file-like object, holding only the
+    unconsumed part of what's been read so far.
+    """
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk into the buffer, returns False at end of file."""
+        if self.eof:
+            return False
+        raw = self.fp.read(self.chunk_size)
+        if not raw:
+            self.eof = True
+            if isinstance(raw, bytes):
+                self.utf8.decode(b'', final=True)
+            return False
+        # Bytes may end part way through a multi byte character, the decoder holds onto those
+        chunk = self.utf8.decode(raw) if isinstance(raw, bytes) else raw
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non whitespace character, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON')
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError(f'Expected one of {chars!r} at {self.pos}, found {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value, reading more as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A value may have been cut short by the end of the buffer, e.g a
+                # number read up to "1." decodes as 1, so only take it once it's
+                # followed by what can follow a value
+                if self.eof or (end < len(self.buf) and self.buf[end] in _value_ends):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_records(data, sections=('inserts', 'updates'), chunk_size=1024 * 1024):
+    """Incrementally decode an ingest payload, e.g {"inserts": [...], "updates": [...]}
+    yielding a (section, item) tuple for each item of the given top level
+    arrays as they're read. Only the item being decoded is held in memory,
+    not the whole payload.
+
+    :param data: the payload as a str/bytes, or a text/binary file-like object
+    :param sections: names of the top level arrays to yield items from, others are skipped
+    :param chunk_size: number of bytes (or characters) to read at a time
+    """
+    if isinstance(data, str):
+        data = io.StringIO(data)
+    elif isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    reader = _Reader(data, chunk_size)
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key in sections and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_batches(data, batch_size=100, skip=0, **kwargs):
+    """Group the records decoded by `iter_records` into batches, yielding a
+    (section, items) tuple for every batch_size items, or fewer when the
+    section changes or at the end of the payload.
+
+    :param skip: number of records to skip, e.g those already loaded
+    """
+    section, items = None, []
+    records = iter_records(data, **kwargs)
+    for _ in itertools.islice(records, skip):
+        pass
+    for record_section, item in records:
+        if items and (record_section != section or len(items) == batch_size):
+            yield section, items
+            items = []
+        section = record_section
+        items.append(item)
+    if items:
+        yield section, items
@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+
+from backend import models
+from backend.datastores import db
+
+_api = '/api/resource/slack'
+
+
+@pytest.fixture
+def bump_version(app):
+    """Bump the version of the given data set, as the ingester does after a load."""
+    def bump(name):
+        with app.app_context():
+            model = models.DataVersion.query.get(name)
+            if model is None:
+                model = models.DataVersion(name=name, version=0)
+                db.session.add(model)
+            model.version += 1
+            model.updated_at = datetime.datetime.utcnow()
+            db.session.commit()
+    return bump
+
+
+@pytest.mark.parametrize('url, dataset, changes', [
+    ('/users', 'users', True),
+    ('/users', 'messages', False),
+    ('/stats/timezones', 'messages', True),
+    ('/stats/timezones', 'users', True),
+    ('/stats/timezones', 'channels', False),
+])
+def test_etag_follows_data_versions(client, headers, bump_version, url, dataset, changes):
+    etag = client.get(_api + url, headers=headers).headers['ETag']
+    bump_version(dataset)
+    assert (client.get(_api + url, headers=headers).headers['ETag'] != etag) == changes
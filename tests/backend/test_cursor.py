@@ -0,0 +1,31 @@
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from backend.helpers import decode_cursor, encode_cursor
+
+_api = '/api/resource/slack'
+
+
+@pytest.mark.parametrize('values', [[], ['1577836800.000000', 'C0000000001'], [1, 2.5, None]])
+def test_round_trip(values):
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize('token', ['W1tdLHt9XQ', 'W3RydWUsIngiXQ', 'eyJhIjoxfQ', 'not a cursor'])
+def test_decode_invalid(token):
+    with pytest.raises(BadRequest):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize('url', [
+    '/messages?after=W1tdLHt9XQ',                                     # [[], {}]
+    '/messages/search?q=docker&after=W1tdLHt9XQ',
+    f'/messages?after={encode_cursor(["1577836800.000000"])}',        # too few values
+    f'/messages?after={encode_cursor(["1577836800.000000", "C0000000001", "x"])}',
+    f'/messages?sort=user_id&after={encode_cursor(["1577836800.000000", "C0000000001"])}',
+    f'/messages/search?q=docker&after={encode_cursor([1])}',
+    f'/users?after={encode_cursor([[], "U0000000001"])}',
+])
+def test_invalid_cursor(client, headers, url):
+    resp = client.get(_api + url, headers=headers)
+    assert resp.status_code == 400
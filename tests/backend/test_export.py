@@ -0,0 +1,40 @@
+import json
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from backend import models
+
+from conftest import MESSAGES
+
+_api = '/api/resource/slack'
+
+
+def test_export(client, headers):
+    resp = client.get(f'{_api}/messages/export?include=', headers=headers)
+    assert resp.status_code == 200
+    lines = resp.get_data(as_text=True).splitlines()
+    assert len(lines) == MESSAGES
+    assert json.loads(lines[0])['id'] < json.loads(lines[-1])['id']
+
+
+def test_export_empty(client, headers):
+    resp = client.get(f'{_api}/messages/export?channel_id=C9999999999', headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_data() == b''
+
+
+@pytest.mark.parametrize('query', ['sort=content', 'sort=id,sideways', 'sort=id,asc,desc'])
+def test_export_invalid_sort(client, headers, query):
+    resp = client.get(f'{_api}/messages/export?{query}', headers=headers)
+    assert resp.status_code == 400
+
+
+def test_export_database_error(app, client, headers, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OperationalError('SELECT', {}, Exception('connection dropped'))
+    monkeypatch.setattr(models.SlackMessage, 'find_all_with_cursor', fail)
+    # Let the app handle it as it would in production, rather than raise it
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', False)
+    resp = client.get(f'{_api}/messages/export', headers=headers)
+    assert resp.status_code == 500
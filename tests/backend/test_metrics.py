@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture
+def metrics_enabled(app):
+    app.config['METRICS_ENABLED'] = True
+    yield
+    app.config['METRICS_ENABLED'] = False
+
+
+def test_metrics_disabled(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics(client, metrics_enabled):
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert '# TYPE ubtsapi_request_seconds histogram' in resp.get_data(as_text=True)
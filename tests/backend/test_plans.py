@@ -0,0 +1,101 @@
+"""
+Every filter and sort the list endpoints allow is served in index order, i.e
+SQLite never sorts the results (USE TEMP B-TREE) to find a page, nor scans
+the table for a filter. Each model's __sortable__ attributes, alone or after
+a filter (see __filtered_sortable__), should lead an index.
+"""
+import pytest
+from sqlalchemy import event
+
+from backend import models
+from backend.datastores import db
+
+_api = '/api/resource/slack'
+
+# path: (model, filter names)
+_lists = {
+    'users': (models.SlackUser, ('tz_offset',)),
+    'channels': (models.SlackChannel, ()),
+    'emojis': (models.SlackEmoji, ()),
+    'files': (models.SlackFile, ('channel_id', 'message_id')),
+    'messages': (models.SlackMessage, ('user_id', 'channel_id', 'thread_id')),
+    'stats/messages': (models.StatChannelDay, ('channel_id',)),
+    'stats/reactors': (models.StatReactor, ()),
+    'stats/emojis': (models.StatEmoji, ()),
+}
+
+
+def _combinations(allowed=True):
+    for path, (model, filters) in _lists.items():
+        for name in (None,) + filters:
+            sortable = model.__filtered_sortable__.get(name, model.__sortable__)
+            for sort in model.__sortable__:
+                if (sort in sortable) != allowed:
+                    continue
+                for sort_dir in ('asc', 'desc'):
+                    yield path, name, f'{sort},{sort_dir}'
+
+
+@pytest.fixture(scope='module')
+def filters(app):
+    """A value to filter by, for each filter name, that finds some rows."""
+    with app.app_context():
+        channel_id, user_id, thread_id = db.session.execute(
+            'SELECT channel_id, user_id, thread_id FROM sl_messages WHERE thread_id IS NOT NULL LIMIT 1').first()
+        message_id = db.session.execute('SELECT message_id FROM sl_files LIMIT 1').scalar()
+        tz_offset = db.session.execute('SELECT tz_offset FROM sl_users LIMIT 1').scalar()
+        db.session.execute('ANALYZE')
+        db.session.commit()
+    return dict(tz_offset=tz_offset, channel_id=channel_id, message_id=message_id, user_id=user_id, thread_id=thread_id)
+
+
+@pytest.fixture
+def plans(app):
+    """List of the query plan steps of every statement run during the test."""
+    rv = []
+
+    def explain(conn, cursor, statement, parameters, *args):
+        if statement.lstrip().startswith('SELECT') and 'FROM data_versions' not in statement \
+                and 'FROM apps' not in statement:
+            rv.extend(row[-1] for row in conn.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', explain)
+    yield rv
+    event.remove(engine, 'before_cursor_execute', explain)
+
+
+@pytest.mark.parametrize('path, name, sort', list(_combinations()))
+def test_no_temp_sort(client, headers, filters, plans, path, name, sort):
+    model, _ = _lists[path]
+    query = f'sort={sort}&total=none&include=' + (f'&{name}={filters[name]}' if name else '')
+    resp = client.get(f'{_api}/{path}?{query}&after=', headers=headers)
+    assert resp.status_code == 200
+    after = resp.get_json()['next']
+    resp = client.get(f'{_api}/{path}?{query}', headers=headers)
+    assert resp.status_code == 200
+    if after:
+        resp = client.get(f'{_api}/{path}?{query}&after={after}', headers=headers)
+        assert resp.status_code == 200
+    assert not [step for step in plans if 'TEMP B-TREE' in step]
+    if name:
+        # Filtered lists seek to the filter, rather than scanning the table
+        assert not [step for step in plans if step.startswith(f'SCAN {model.__tablename__}')]
+
+
+@pytest.mark.parametrize('path, name, sort', list(_combinations(allowed=False)))
+def test_unindexed_sort(client, headers, filters, path, name, sort):
+    resp = client.get(f'{_api}/{path}?sort={sort}&{name}={filters[name]}', headers=headers)
+    assert resp.status_code == 400
+
+
+
+def test_thread_seeks(client, headers, filters, plans):
+    resp = client.get(f'{_api}/messages/{filters["channel_id"]}/{filters["thread_id"]}/thread?include=', headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_json()['items']
+    # A seek of the thread index for the replies (and of another index for
+    # the parent), then a lookup of the rest of each message, e.g its content
+    assert 'SEARCH sl_messages USING INDEX ix_sl_messages_channel_thread (channel_id=? AND thread_id=?)' in plans
+    assert not [step for step in plans if step.startswith('SCAN') or 'COVERING' in step]
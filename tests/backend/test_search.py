@@ -0,0 +1,39 @@
+import pytest
+
+import dataset
+from backend import models
+from backend.datastores import db
+
+from conftest import MESSAGES
+
+
+@pytest.fixture
+def session(app):
+    """The session, rolled back after the test."""
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+
+
+def _search(q):
+    return [message.id for message in models.SlackMessage.search(q, per_page=10)['items']]
+
+
+def test_fts5_backend(session):
+    assert models.SlackMessage.search_backend() == 'fts5'
+
+
+def test_fts5_triggers(session):
+    mid = dataset.message_id(MESSAGES)
+    session.execute(models.SlackMessage.__table__.insert(), dict(
+        id=mid, channel_id=dataset.channel_id(0), user_id=dataset.user_id(0),
+        content='a zyzzyva', deleted=False, search_id=MESSAGES + 1))
+    assert _search('zyzzyva') == [mid]
+
+    session.execute(models.SlackMessage.__table__.update().where(
+        models.SlackMessage.id == mid).values(content='a quokka'))
+    assert _search('zyzzyva') == []
+    assert _search('quokka') == [mid]
+
+    session.execute(models.SlackMessage.__table__.delete().where(models.SlackMessage.id == mid))
+    assert _search('quokka') == []
@@ -0,0 +1,132 @@
+"""
+The number of SQL statements each endpoint runs, so related models keep being
+loaded a relationship at a time (not a model at a time) as endpoints change.
+"""
+import pytest
+
+import dataset
+from backend import metrics, models
+from backend.datastores import db
+
+from conftest import MESSAGES
+
+_api = '/api/resource/slack'
+
+
+def _queries(statements):
+    # With caching off the data versions are looked up by every request, and 
+    # API keys by the first request to use them
+    return [s for s in statements if 'FROM data_versions' not in s and 'FROM apps' not in s]
+
+
+@pytest.fixture
+def message(app):
+    """A message that's in a thread, and has files and reactions."""
+    with app.app_context():
+        row = db.session.execute("""
+            SELECT m.channel_id, m.id, m.thread_id FROM sl_messages AS m
+             WHERE m.thread_id IS NOT NULL
+               AND EXISTS (SELECT 1 FROM sl_files AS f WHERE f.message_id = m.id AND f.channel_id = m.channel_id)
+               AND EXISTS (SELECT 1 FROM sl_reactions AS r WHERE r.message_id = m.id AND r.channel_id = m.channel_id)
+             LIMIT 1
+        """).first()
+    return dict(row)
+
+
+@pytest.mark.parametrize('url, count', [
+    ('/messages?total=none', 3),
+    ('/messages?include=files,reactions&total=none', 3),
+    ('/messages?include=&total=none', 1),
+    ('/messages?include=files,reactions', 4),
+    ('/messages?channel_id=C0000000001&include=files&total=none', 2),
+    ('/users?total=none', 1),
+    ('/channels?total=none', 1),
+    ('/emojis?total=none', 1),
+    ('/files?total=none', 1),
+    ('/files?channel_id=C0000000001&total=none', 1),
+    ('/stats/messages?total=none', 1),
+    ('/stats/reactors?total=none', 1),
+    ('/stats/emojis?total=none', 1),
+    ('/stats/timezones', 1),
+])
+def test_list(client, headers, statements, url, count):
+    resp = client.get(_api + url, headers=headers)
+    assert resp.status_code == 200
+    assert len(_queries(statements)) == count
+
+
+@pytest.mark.parametrize('url, count', [
+    # A batch of 500 at a time (see iter_all), each with a query per relationship
+    ('/messages/export?include=', MESSAGES // 500),
+    ('/messages/export?include=files,reactions', MESSAGES // 500 * 3),
+    ('/messages/export?include=files,reactions&sort=user_id', MESSAGES // 500 * 3),
+    ('/users/export', -(-dataset.USERS // 500)),
+])
+def test_export(client, headers, statements, url, count):
+    resp = client.get(_api + url, headers=headers)
+    assert resp.status_code == 200
+    # Streamed, so the batches are only fetched as the body is read
+    assert resp.get_data()
+    assert len(_queries(statements)) == count
+
+
+def test_search(client, headers, statements):
+    # The search backend is looked up by the first search
+    client.get(f'{_api}/messages/search?q=docker&total=none', headers=headers)
+    del statements[:]
+    resp = client.get(f'{_api}/messages/search?q=docker&total=none', headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_json()['items']
+    assert len(_queries(statements)) == 3
+
+
+def test_get_message(client, headers, message, statements):
+    resp = client.get(f'{_api}/messages/{message["channel_id"]}/{message["id"]}', headers=headers)
+    assert resp.status_code == 200
+    assert len(_queries(statements)) == 3
+
+
+def test_thread(client, headers, message, statements):
+    resp = client.get(f'{_api}/messages/{message["channel_id"]}/{message["thread_id"]}/thread', headers=headers)
+    assert resp.status_code == 200
+    assert len(resp.get_json()['items']) > 1
+    assert len(_queries(statements)) == 3
+
+
+def test_batch_get_messages(client, headers, statements):
+    resp = client.get(f'{_api}/messages?include=&total=none&per_page=50', headers=headers)
+    keys = [dict(channel_id=m['channel_id'], id=m['id']) for m in resp.get_json()['items']]
+    del statements[:]
+    resp = client.post(f'{_api}/messages:batchGet', headers=headers, json=dict(messages=keys))
+    assert resp.status_code == 200
+    assert len(resp.get_json()['items']) == 50
+    assert len(_queries(statements)) == 3
+
+
+def test_batch_get_threads(client, headers, statements):
+    resp = client.get(f'{_api}/messages?include=&total=none&per_page=50', headers=headers)
+    threads = [dict(channel_id=m['channel_id'], thread_id=m['thread_id'])
+               for m in resp.get_json()['items'] if m['thread_id']]
+    del statements[:]
+    resp = client.post(f'{_api}/messages/threads:batchGet', headers=headers, json=dict(threads=threads))
+    assert resp.status_code == 200
+    assert len(resp.get_json()['items']) > 1
+    assert len(_queries(statements)) == 3
+
+
+def test_batch_get_users(client, headers, statements):
+    ids = [f'U{i:010d}' for i in range(50)]
+    resp = client.post(f'{_api}/users:batchGet', headers=headers, json=dict(ids=ids))
+    assert resp.status_code == 200
+    assert len(resp.get_json()['items']) == 50
+    assert len(_queries(statements)) == 1
+
+
+def test_repeated_statement_raises(app):
+    with app.test_request_context(f'{_api}/messages'):
+        app.preprocess_request()
+        messages = models.SlackMessage.query.limit(20).all()
+        with pytest.raises(metrics.RepeatedStatementError):
+            # Lazy loads each message's files, one statement per message
+            for message in messages:
+                message.files
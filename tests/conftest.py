@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../benchmarks'))
+
+import dataset
+
+# Required by create_app, but not used by the tests
+for name, value in (('FLASK_SECRET_KEY', 'test'), ('BLOB_ACCOUNT_NAME', 'test'),
+                    ('BLOB_DATASET_CONTAINER_NAME', 'test'), ('BLOB_ACCOUNT_KEY', 'dGVzdA==')):
+    os.environ.setdefault(name, value)
+
+# Messages in the test dataset, enough for several pages of everything
+MESSAGES = 2000
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The app, with TESTING on, against a SQLite copy of the benchmarks' 
+    (seeded) synthetic dataset.
+    """
+    uri = f'sqlite:///{tmp_path_factory.mktemp("data") / "slack.db"}'
+    app = dataset.create_app(uri)
+    app.config['TESTING'] = True
+    dataset.build(app, MESSAGES)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def headers():
+    """Headers authorizing requests as the dataset's application."""
+    return {'Authorization': dataset.TOKEN}
+
+
+@pytest.fixture
+def statements(app):
+    """List of the SQL statements run during the test."""
+    from sqlalchemy import event
+    from backend.datastores import db
+
+    rv = []
+
+    def record(conn, cursor, statement, *args):
+        rv.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield rv
+    event.remove(engine, 'before_cursor_execute', record)
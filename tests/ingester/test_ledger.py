@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+try:
+    import pyodbc  # noqa: F401
+except ImportError:
+    # support.db needs pyodbc (and the ODBC driver manager) to import
+    pytest.skip('pyodbc is not installed', allow_module_level=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../ingester'))
+
+from support import db, ledger
+
+
+class _Cursor:
+    """sqlite3 cursor that behaves like pyodbc's, e.g commits on exit."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.raw.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None and not self.conn.autocommit:
+            self.conn.commit()
+
+    def execute(self, stmt, *params):
+        self.cursor.execute(stmt, params)
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+
+class _Connection:
+    """sqlite3 connection that behaves like pyodbc's, enough for the ledger."""
+    def __init__(self):
+        self.raw = sqlite3.connect(':memory:', isolation_level=None)
+        self.raw.create_function('getdate', 0, lambda: '2021-01-01 00:00:00')
+        self.raw.executescript("""
+            CREATE TABLE ingest_files (content_hash TEXT PRIMARY KEY, records INT, completed_at TEXT, updated_at TEXT);
+            CREATE TABLE rows (id INT);
+            INSERT INTO ingest_files (content_hash, records) VALUES ('abc', 0);
+        """)
+
+    @property
+    def autocommit(self):
+        return self.raw.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.raw.isolation_level = None if value else 'DEFERRED'
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        pass
+
+
+def _write_batch(conn, ids):
+    cursor = conn.cursor()
+    for id in ids:
+        cursor.execute('INSERT INTO rows (id) VALUES (?)', id)
+
+
+def test_autocommit_reaches_connection():
+    raw = _Connection()
+    with db.PooledConnection(db.ConnectionPool(1, 30), raw) as conn:
+        conn.autocommit = False
+        assert raw.autocommit is False
+    # Back on for the next user of the connection
+    assert raw.autocommit is True
+
+
+def test_batch_rolled_back_with_checkpoint():
+    raw = _Connection()
+    with pytest.raises(RuntimeError):
+        with db.PooledConnection(db.ConnectionPool(1, 30), raw) as conn:
+            entry = ledger.Entry(conn, 'messages', 'messages.json', 'abc')
+            conn.autocommit = False  # as left by Entry.begin
+            _write_batch(conn, [1, 2])
+            entry.checkpoint(2)
+            _write_batch(conn, [3, 4])
+            raise RuntimeError('failed before the checkpoint')
+
+    assert raw.raw.execute('SELECT id FROM rows ORDER BY id').fetchall() == [(1,), (2,)]
+    assert raw.raw.execute('SELECT records FROM ingest_files').fetchone() == (2,)
+
+
+class _DisconnectedConnection(_Connection):
+    """Connection that's gone, once the transaction has started."""
+    def _gone(self):
+        raise pyodbc.Error('08S01', 'Communication link failure')
+
+    commit = rollback = _gone
+
+
+def test_failed_rollback_discards_connection():
+    pool, raw = db.ConnectionPool(1, 30), _DisconnectedConnection()
+    with pytest.raises(RuntimeError):
+        with db.PooledConnection(pool, raw) as conn:
+            conn.autocommit = False
+            raise RuntimeError('failed mid transaction')
+    assert conn._conn is None
+    assert not pool._idle
+
+
+def test_failed_commit_discards_connection():
+    pool, raw = db.ConnectionPool(1, 30), _DisconnectedConnection()
+    with pytest.raises(pyodbc.Error):
+        with db.PooledConnection(pool, raw) as conn:
+            conn.autocommit = False
+    assert conn._conn is None
+    assert not pool._idle
@@ -0,0 +1,36 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../ingester'))
+
+from support import stream
+
+_payload = json.dumps({
+    'inserts': [1.5, 2, -3e-2, 4E+10, 'café \U0001f389', True, False, None, {'id': '1607911117.028300', 'files': []}],
+    'skipped': {'a': [1.25, 'x']},
+    'updates': [[0.5], 10]
+}, ensure_ascii=False).encode('utf-8')
+
+_records = [('inserts', r) for r in json.loads(_payload)['inserts']] + \
+    [('updates', r) for r in json.loads(_payload)['updates']]
+
+
+@pytest.mark.parametrize('chunk_size', range(1, len(_payload) + 1))
+def test_every_chunk_size(chunk_size):
+    assert list(stream.iter_records(io.BytesIO(_payload), chunk_size=chunk_size)) == _records
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 14])
+def test_number_split_after_point(chunk_size):
+    assert list(stream.iter_records(io.BytesIO(b'{"inserts":[1.5,2]}'), chunk_size=chunk_size)) == \
+        [('inserts', 1.5), ('inserts', 2)]
+
+
+def test_batches_skip():
+    batches = list(stream.iter_batches(_payload, batch_size=4, skip=2))
+    assert batches == [('inserts', [r for _, r in _records[2:6]]), ('inserts', [r for _, r in _records[6:9]]),
+                       ('updates', [r for _, r in _records[9:]])]